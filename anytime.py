@@ -0,0 +1,322 @@
+"""Searching for schedules in the background, with results available at
+any time.
+
+AnytimeSearch runs the same search as get_sorted_schedules in a thread,
+so the best schedules found so far can be looked at while it runs. It can
+be given a budget of seconds, of search tree nodes or of schedules, after
+which it stops with what it has found. The budget is checked at every node
+of the search, so it holds even in subtrees that yield no schedules. Its
+progress is measured against the number of schedules, which can be
+counted alongside the search (see counting.py), or else estimated from
+where in the search tree the last schedule found was.
+
+At most RUN_SIZE of the schedules found are held in memory: each time that
+many have been found, they are sorted and written to a temporary file in
+the binary store format (see store.py). The results are those sorted runs,
+merged only as far as they are read.
+"""
+
+from counting import count_schedules
+from datatypes import Schedule, Section
+from itertools import islice
+from operator import itemgetter
+from scheduler import (TIE_BREAKS, read_courses, exact_score, score_scale,
+                       stream_scored)
+from typing import Iterator, Sequence
+import heapq
+import os
+import store
+import tempfile
+import threading
+import time
+
+# the most schedules held in memory before they are written out as a run
+RUN_SIZE = 100_000
+
+
+def tree_position(schedule: Schedule, courses: list[list[Section]],
+                  position: dict[Section, int],
+                  course_index: dict[str, int]) -> float:
+    """The fraction of the search tree before schedule, counting every
+    choice at a course (one of its sections or, last, skipping it) as an
+    equal share of its branch.
+    """
+    chosen = [None] * len(courses)
+    for section in schedule.sections:
+        chosen[course_index[section.course]] = position[section]
+    fraction = 0.0
+    share = 1.0
+    for i, course in enumerate(courses):
+        if not course:
+            continue
+        options = len(course) + (not course[0].is_mandatory())
+        choice = chosen[i] if chosen[i] is not None else len(course)
+        share /= options
+        fraction += choice * share
+    return fraction
+
+
+class SortedRuns(Sequence):
+    """The schedules of runs that are each sorted by exact score (see
+    scheduler.exact_score) and then by tie_break (see
+    scheduler.TIE_BREAKS), in one sorted sequence. Schedules tied with
+    ones of a later run come first. The runs are merged as they are read,
+    so only the schedules up to the last one asked for are held.
+    """
+    def __init__(self, runs: list[Sequence[Schedule]], scale: int,
+                 tie_break: str = 'generation'):
+        self.runs = runs
+        self.scale = scale
+        self.tie_break = tie_break
+        self.length = sum(len(run) for run in runs)
+        self.merge = iter(self)
+        self.merged: list[Schedule] = []
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i: int | slice) -> Schedule | list[Schedule]:
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("schedule index out of range")
+        if i >= len(self.merged):
+            self.merged += islice(self.merge, i + 1 - len(self.merged))
+        return self.merged[i]
+
+    def __iter__(self) -> Iterator[Schedule]:
+        # merge takes the earlier run first on ties
+        tie_key = TIE_BREAKS[self.tie_break]
+        if tie_key is None:
+            return heapq.merge(*self.runs,
+                               key = lambda s: -exact_score(s, self.scale))
+        return heapq.merge(*self.runs,
+                           key = lambda s: (-exact_score(s, self.scale),
+                                            tie_key(s)))
+
+
+class AnytimeSearch:
+    """Generates the schedules of courses (read from course_data.txt if not
+    given) in a background thread. Stops early after seconds, after
+    visiting max_nodes nodes of the search tree, or after finding
+    max_schedules schedules, if given. If the total number of
+    schedules is given, progress is measured against it instead of
+    estimated. If not, it is counted in another background thread when
+    count_seconds is given, giving up after that many seconds.
+    Once it is done without running out of budget, results has exactly the
+    schedules get_sorted_schedules returns for tie_break, in the same order.
+    """
+    def __init__(self, courses: list[list[Section]] | None = None,
+                 seconds: float | None = None,
+                 max_nodes: int | None = None,
+                 max_schedules: int | None = None,
+                 total: int | None = None,
+                 count_seconds: float | None = None,
+                 tie_break: str = 'generation'):
+        if courses is None:
+            courses = read_courses()
+        self.courses = courses
+        self.seconds = seconds
+        self.max_nodes = max_nodes
+        self.max_schedules = max_schedules
+        self.total = total
+        self.count_seconds = count_seconds
+        self.tie_break = tie_break
+        self.counting = False
+        self.count_found = 0
+        self.last: Schedule | None = None       # the last schedule found
+        # the schedules found since the last run was written, with their
+        # exact scores, and the runs written (see SortedRuns)
+        self.buffer: list[tuple[Schedule, int]] = []
+        self.runs: list[store.ScheduleReader] = []
+        self.lock = threading.Lock()    # held to swap the buffer for a run
+        self.folder: tempfile.TemporaryDirectory | None = None
+        self.nodes = 0
+        self.best: float | None = None
+        self.done = False
+        self.exhausted = False      # stopped by its budget
+        self.error: BaseException | None = None
+        self.start_time: float | None = None
+        self.end_time: float | None = None
+        self.deadline: float | None = None
+        self.stopping = False
+        self.scale = score_scale(courses)
+        # the last results
+        self.sorted = SortedRuns([], self.scale, tie_break)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.count_thread = threading.Thread(target=self.count, daemon=True)
+        self.position = {section: i for course in courses
+                         for i, section in enumerate(course)}
+        self.course_index = {course[0].course: i
+                             for i, course in enumerate(courses) if course}
+
+    def start(self) -> 'AnytimeSearch':
+        self.start_time = time.perf_counter()
+        self.thread.start()
+        if self.total is None and self.count_seconds is not None:
+            self.counting = True
+            self.count_thread.start()
+        return self
+
+    def count(self):
+        """Counts the schedules, for measuring progress."""
+        try:
+            self.total = count_schedules(
+                self.courses, self.start_time + self.count_seconds)['total']
+        except TimeoutError:
+            pass        # progress stays estimated
+        finally:
+            self.counting = False
+
+    def should_stop(self) -> bool:
+        """Called at every node of the search before it is expanded. The
+        search ends once this returns True: when stopped or out of budget.
+        Only the nodes expanded are counted, so exactly max_nodes are.
+        """
+        if self.stopping or self.exhausted:
+            return True
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.exhausted = True
+            return True
+        self.nodes += 1
+        # checking the clock every node would slow the search
+        if (self.deadline is not None and self.nodes % 256 == 0
+                and time.perf_counter() > self.deadline):
+            self.exhausted = True
+            return True
+        return False
+
+    def run(self):
+        if self.seconds is not None:
+            self.deadline = self.start_time + self.seconds
+        try:
+            for schedule, score in stream_scored(self.courses,
+                                                 self.should_stop):
+                self.buffer.append((schedule, score))
+                self.last = schedule
+                self.count_found += 1
+                if self.best is None or schedule.score > self.best:
+                    self.best = schedule.score
+                if len(self.buffer) >= RUN_SIZE:
+                    self.write_run()
+                if (self.max_schedules is not None
+                        and self.count_found >= self.max_schedules):
+                    self.exhausted = True
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.end_time = time.perf_counter()
+            self.done = True
+
+    def write_run(self):
+        """Sorts the buffer and writes it to a temporary file as a run."""
+        if self.folder is None:
+            self.folder = tempfile.TemporaryDirectory(
+                ignore_cleanup_errors=True)
+        run = self.sort_buffer(self.buffer)
+        path = os.path.join(self.folder.name,
+                            'run{}.bin'.format(len(self.runs)))
+        sections = [section for course in self.courses for section in course]
+        with open(path, 'wb') as f:
+            store.write_schedules(f, (schedule for schedule, _ in run),
+                                  sections)
+        with open(path, 'rb') as f:
+            reader = store.ScheduleReader(f)
+        with self.lock:
+            self.runs.append(reader)
+            self.buffer = []
+
+    def sort_buffer(self, buffer: list[tuple[Schedule, int]]
+                    ) -> list[tuple[Schedule, int]]:
+        """Sorts schedules with their exact scores as the runs are sorted.
+        The sort is stable, so ties stay in the order they were found.
+        """
+        tie_key = TIE_BREAKS[self.tie_break]
+        if tie_key is None:
+            return sorted(buffer, key = itemgetter(1), reverse = True)
+        return sorted(buffer, key = lambda pair: (-pair[1], tie_key(pair[0])))
+
+    def stop(self):
+        """Stops the search, keeping what it found."""
+        self.stopping = True
+        self.thread.join()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Waits for the search to end, for at most timeout seconds.
+        Returns whether it has ended.
+        """
+        self.thread.join(timeout)
+        return self.done
+
+    def results(self) -> SortedRuns:
+        """The schedules found so far, sorted by exact score (see
+        scheduler.exact_score) and then by tie_break. Ties left are in the
+        order they were found, which is generation order. The same object
+        is returned until more are found.
+        """
+        with self.lock:
+            runs: list[Sequence[Schedule]] = list(self.runs)
+            buffer = list(self.buffer)
+        if len(buffer) + sum(len(run) for run in runs) != len(self.sorted):
+            runs.append([schedule for schedule, _
+                         in self.sort_buffer(buffer)])
+            self.sorted = SortedRuns(runs, self.scale, self.tie_break)
+        return self.sorted
+
+    def progress(self) -> dict:
+        """The schedules found, the best score so far, the estimated
+        fraction of the search done and the estimated seconds left.
+        """
+        found = self.count_found
+        end = self.end_time if self.done else time.perf_counter()
+        elapsed = end - self.start_time if self.start_time is not None else 0
+        if self.done and not self.exhausted and self.error is None \
+                and not self.stopping:
+            fraction = 1.0
+        elif self.total:
+            fraction = found / self.total
+        elif found:
+            fraction = tree_position(self.last, self.courses,
+                                     self.position, self.course_index)
+        else:
+            fraction = 0.0
+        if self.done:
+            remaining = 0.0
+        elif fraction > 0:
+            remaining = elapsed * (1 - fraction) / fraction
+            if self.seconds is not None:
+                remaining = min(remaining, self.seconds - elapsed)
+        else:
+            remaining = None
+        return {'found': found, 'best score': self.best,
+                'fraction done': fraction, 'elapsed': elapsed,
+                'seconds left': remaining, 'done': self.done,
+                'exhausted': self.exhausted}
+
+    def __repr__(self):
+        p = self.progress()
+        s = '{} schedules found'.format(p['found'])
+        if p['best score'] is not None:
+            s += ', best score {:.2f}'.format(p['best score'])
+        if self.total is not None:
+            s = s.replace(' schedules found',
+                          ' of {} schedules found'.format(self.total), 1)
+        if p['done']:
+            if p['exhausted']:
+                return s + ', stopped by the budget at about {:.0%} ' \
+                           'of the search'.format(p['fraction done'])
+            if self.stopping:
+                return s + ', stopped at about {:.0%} of the ' \
+                           'search'.format(p['fraction done'])
+            if self.error is not None:
+                return s + ', search failed: ' + repr(self.error)
+            return s + ', search finished'
+        s += ', about {:.0%} searched'.format(p['fraction done'])
+        if self.counting:
+            s += ' (still counting the schedules)'
+        if p['seconds left'] is not None:
+            s += ', about {:.0f}s left'.format(p['seconds left'])
+        return s
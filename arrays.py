@@ -0,0 +1,176 @@
+"""Array-backed schedule collections for bulk filtering and scoring.
+
+A ScheduleArray holds a set of schedules as NumPy columns (score, start
+minute, end minute) and a schedule-by-section membership matrix, so
+filters, rescoring and sorting run over the whole set at once.
+
+NumPy is optional: nothing else in the scheduler needs it, and this module
+only raises when a ScheduleArray is made without it.
+"""
+
+from datatypes import Schedule, Section, PRIORITY_D
+from scheduler import exact_threshold, priority_scale
+import store
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def minutes(t) -> int:
+    return t.hour * 60 + t.minute
+
+
+class ScheduleArray:
+    """Columns of a list of schedules, in the same order.
+    sections is the catalog the membership matrix's columns refer to.
+    """
+    def __init__(self, sections: list[Section], score, start, end,
+                 membership):
+        if np is None:
+            raise ImportError("ScheduleArray requires numpy")
+        self.sections = sections
+        self.columns = {store.section_key(section): i
+                        for i, section in enumerate(sections)}
+        self.score = score              # float64, one per schedule
+        self.start = start              # int16 minutes since midnight
+        self.end = end                  # int16 minutes since midnight
+        self.membership = membership    # bool, schedules by sections
+
+    def __len__(self):
+        return len(self.score)
+
+    def __getitem__(self, i: int) -> Schedule:
+        sections = [self.sections[j]
+                    for j in np.flatnonzero(self.membership[i])]
+        start_time = min(section.start_time for section in sections)
+        end_time = max(section.end_time for section in sections)
+        return Schedule(sections, float(self.score[i]), start_time, end_time)
+
+    @classmethod
+    def from_schedules(cls, schedules: list[Schedule],
+                       sections: list[Section]):
+        """Builds the columns from Schedule objects."""
+        if np is None:
+            raise ImportError("ScheduleArray requires numpy")
+        columns = {store.section_key(section): i
+                   for i, section in enumerate(sections)}
+        n = len(schedules)
+        score = np.fromiter((s.score for s in schedules), np.float64, n)
+        start = np.fromiter((minutes(s.start_time) for s in schedules),
+                            np.int16, n)
+        end = np.fromiter((minutes(s.end_time) for s in schedules),
+                          np.int16, n)
+        membership = np.zeros((n, len(sections)), dtype=bool)
+        for i, schedule in enumerate(schedules):
+            for section in schedule.sections:
+                membership[i, columns[store.section_key(section)]] = True
+        return cls(sections, score, start, end, membership)
+
+    @classmethod
+    def from_store(cls, reader: store.ScheduleReader):
+        """Builds the columns straight from the records of a binary
+        schedule file, without making any Schedule objects.
+        """
+        if np is None:
+            raise ImportError("ScheduleArray requires numpy")
+        record = np.dtype([('score', '<f8'),
+                           ('sections', '<u2', (reader.width,))])
+        records = np.frombuffer(reader.mm, dtype=record, count=len(reader),
+                                offset=reader.offset)
+        indices = records['sections'].astype(np.int64)
+        present = indices != store.EMPTY
+        indices[~present] = 0
+        starts = np.array([minutes(s.start_time) for s in reader.sections]
+                          + [0], dtype=np.int16)
+        ends = np.array([minutes(s.end_time) for s in reader.sections]
+                        + [0], dtype=np.int16)
+        # empty slots are pointed at a sentinel that never wins min or max
+        starts[-1] = np.iinfo(np.int16).max
+        ends[-1] = np.iinfo(np.int16).min
+        slots = np.where(present, indices, len(reader.sections))
+        membership = np.zeros((len(reader), len(reader.sections)), dtype=bool)
+        rows = np.broadcast_to(np.arange(len(reader))[:, None], slots.shape)
+        membership[rows[present], slots[present]] = True
+        return cls(reader.sections, records['score'].copy(),
+                   starts[slots].min(axis=1), ends[slots].max(axis=1),
+                   membership)
+
+    def rescore(self):
+        """Recomputes every score from PRIORITY_D (see
+        Schedule.updateScore). Sums may differ from updateScore's in the
+        last bits, since they aren't added up in section order.
+        """
+        weights = np.array([0 if PRIORITY_D[s.course] == 0
+                            else 1 / PRIORITY_D[s.course]
+                            for s in self.sections], dtype=np.float64)
+        self.score = self.membership @ weights
+
+    def mask(self, kind: str, *args, **kwargs):
+        """Returns the boolean mask of the schedules that pass the filter
+        made by filter.make_filter(kind, *args, **kwargs).
+        """
+        if kind == 'time':
+            if len(kwargs) < 1:
+                raise ValueError("No start or end time was provided"
+                                 "for the time filter.")
+            mask = np.ones(len(self), dtype=bool)
+            start = kwargs.get('start')
+            end = kwargs.get('end')
+            if start is not None:
+                mask &= self.start >= int(start[0:2]) * 60 + int(start[2:4])
+            if end is not None:
+                mask &= self.end <= int(end[0:2]) * 60 + int(end[2:4])
+            return mask
+
+        if kind == 'score':
+            # compared exactly, like filter.make_filter
+            return (self.exact_scores()
+                    >= exact_threshold(args[0], priority_scale()))
+
+        if kind in ('courses_I', 'courses_X'):
+            cols = [i for i, section in enumerate(self.sections)
+                    if section.course in args]
+            mask = self.membership[:, cols].any(axis=1)
+            return mask if kind == 'courses_I' else ~mask
+
+        if kind in ('sections_I', 'sections_X'):
+            cols = [self.columns[(course, section)] for course, section in args
+                    if (course, section) in self.columns]
+            mask = self.membership[:, cols].any(axis=1)
+            return mask if kind == 'sections_I' else ~mask
+
+        raise ValueError("'{}' is not an allowed kind of filter.".format(kind))
+
+    def select(self, filterer):
+        """Returns the positions of the schedules that pass every active
+        filter of a filter.Filterer.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for _, info in filterer.filters:
+            mask &= self.mask(info['kind'], *info['args'], **info['kwargs'])
+        return np.flatnonzero(mask)
+
+    def exact_scores(self):
+        """The exact score (see scheduler.exact_score) of every schedule in
+        units of 1 / priority_scale(), summed from the integer weight of
+        each section's course rather than scaled from the float scores.
+        Python ints are used if the sums could overflow int64.
+        """
+        scale = priority_scale()
+        weights = [0 if PRIORITY_D[s.course] == 0
+                   else scale // PRIORITY_D[s.course] for s in self.sections]
+        courses = len(set(s.course for s in self.sections))
+        if scale * courses < 2**63:
+            return self.membership @ np.array(weights, dtype=np.int64)
+        return (self.membership.astype(object)
+                @ np.array(weights, dtype=object))
+
+    def order(self):
+        """Returns the positions of the schedules sorted by exact score,
+        keeping ties in their current order like get_sorted_schedules.
+        """
+        # ranked on the exact scores, like mask('score'), so float sums in
+        # a different order still tie
+        return np.argsort(-self.exact_scores(), kind='stable')
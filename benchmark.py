@@ -0,0 +1,520 @@
+"""Benchmarks for the performance-sensitive parts of the scheduler.
+
+Run from the repository root: python benchmark.py
+By default the benchmarks run on data/course_data.txt. Pass --courses (and
+optionally --sections, --density, --mandatory and --seed) to run them on a
+synthetic catalog instead. Each run is appended to RESULTS_PATH, and
+--compare shows how it changed since the last run on the same catalog.
+Times are seconds per run.
+"""
+
+from datatypes import Schedule, Section, PRIORITY_D
+from scheduler import (read_sections, make_conflict_matrix, make_schedules,
+                       get_top_schedules, stream_schedules, stream_scored,
+                       readJSON,
+                       bucket_sort, TIE_BREAKS, COURSE_DATA_PATH)
+from browser import make_page
+from compact import Catalog, CompactSchedule
+from compression import write_json_array
+from contextlib import contextmanager
+from datetime import datetime, time
+from filter import (Filterer, ScheduleIndex, bitmap_to_ids, layer_filters,
+                    make_filter)
+from io import StringIO
+from itertools import combinations
+import argparse
+import importlib.util
+import json
+import os
+import random
+import store
+import subprocess
+import tempfile
+import timeit
+import tracemalloc
+
+RESULTS_PATH = 'benchmark_results.jsonl'
+
+# the teaching week synthetic sections are placed in
+DAY_START = 8 * 60
+DAY_LENGTH = 14 * 60
+PATTERNS = ['MWF', 'MW', 'TR', 'M', 'T', 'W', 'R', 'F']
+
+
+def synthetic_catalog(courses: int = 10, sections: int = 4,
+                      density: float = 0.05, mandatory: int = 1,
+                      seed: int = 0) -> tuple[str, dict[str, int]]:
+    """Returns a random catalog, as text in the format read_sections reads,
+    and its priorities.
+    Each section meets for density of the teaching week (MTWRF, 08:00 to
+    22:00), split over the days of a random meeting pattern, so higher
+    densities make more conflicts. The first mandatory courses get
+    priority 0 and the rest a random priority from 1 to 4.
+    """
+    rng = random.Random(seed)
+    lines = []
+    priorities = {}
+    for c in range(courses):
+        code = 'SYN{:03d}'.format(c)
+        priorities[code] = 0 if c < mandatory else rng.randint(1, 4)
+        lines.append(code)
+        for s in range(sections):
+            days = rng.choice(PATTERNS)
+            length = 5 * DAY_LENGTH * density / len(days)
+            length = max(5, min(DAY_LENGTH, round(length / 5) * 5))
+            start = DAY_START + rng.randrange(0, DAY_LENGTH - length + 1, 5)
+            end = start + length
+            lines.append('    {:02d} {} {:02d}{:02d}-{:02d}{:02d}'.format(
+                s + 1, days, start // 60, start % 60, end // 60, end % 60))
+        lines.append('')
+    return '\n'.join(lines), priorities
+
+
+@contextmanager
+def using_priorities(priorities: dict[str, int]):
+    """Swaps PRIORITY_D for priorities in the with block."""
+    saved = dict(PRIORITY_D)
+    PRIORITY_D.clear()
+    PRIORITY_D.update(priorities)
+    try:
+        yield
+    finally:
+        PRIORITY_D.clear()
+        PRIORITY_D.update(saved)
+
+
+def timed(function, number: int) -> float:
+    """Seconds per call of function, over number calls."""
+    return timeit.timeit(function, number=number) / number
+
+
+def conflicts_with_scan(section: Section, other: Section | Schedule) -> bool:
+    """The original pairwise implementation of Section.conflicts_with,
+    kept as a reference for the occupancy bitset engine.
+    """
+    if type(other) == Schedule:
+        for other_section in other.sections:
+            if conflicts_with_scan(section, other_section):
+                return True
+        return False
+    # first check days
+    if not any(day in other.days for day in section.days):
+        return False
+    # then times
+    if (section.start_time >= other.start_time
+        and section.start_time <= other.end_time):
+        return True
+    if (other.start_time >= section.start_time
+        and other.start_time <= section.end_time):
+        return True
+    return False
+
+
+def off_grid_sections() -> list[Section]:
+    """Sections starting and ending at every minute around 10:50, so the
+    bitset engine is also checked on times that aren't multiples of 5.
+    """
+    sections = []
+    for start in range(10 * 60 + 40, 11 * 60 + 1):
+        for length in (1, 9, 10, 11):
+            sections.append(Section(
+                'OFF', str(len(sections)), ['M'],
+                [time(start // 60, start % 60),
+                 time((start + length) // 60, (start + length) % 60)]))
+    return sections
+
+
+def bench_conflicts(sections: list[Section], number: int = 5) -> dict:
+    """Times every section against every other section and against a
+    schedule holding one section from each course, with both engines.
+    Also checks that the two engines agree, there and on off_grid_sections.
+    """
+    for a, b in combinations(off_grid_sections(), 2):
+        assert a.conflicts_with(b) == conflicts_with_scan(a, b), (a, b)
+
+    pairs = list(combinations(sections, 2))
+    schedule = Schedule()
+    seen_courses = set()
+    for section in sections:
+        if (section.course not in seen_courses
+                and not section.conflicts_with(schedule)):
+            schedule = schedule.add(section)
+            seen_courses.add(section.course)
+
+    for a, b in pairs:
+        assert a.conflicts_with(b) == conflicts_with_scan(a, b), (a, b)
+
+    results = {}
+    results['pairs scan'] = timed(
+        lambda: [conflicts_with_scan(a, b) for a, b in pairs], number)
+    results['pairs bitset'] = timed(
+        lambda: [a.conflicts_with(b) for a, b in pairs], number)
+    results['schedule scan'] = timed(
+        lambda: [conflicts_with_scan(s, schedule) for s in sections], number)
+    results['schedule bitset'] = timed(
+        lambda: [s.conflicts_with(schedule) for s in sections], number)
+    return results
+
+
+def bench_generation(courses: list[list[Section]], number: int = 5) -> dict:
+    """Times building the conflict matrix and the full recursive search."""
+    results = {}
+    results['conflict matrix'] = timed(
+        lambda: make_conflict_matrix(courses), number)
+    results['make_schedules'] = timed(
+        lambda: make_schedules(Schedule(), courses), number)
+    results['top 5 schedules'] = timed(
+        lambda: get_top_schedules(5, courses), number)
+    results['constrained search'] = timed(
+        lambda: list(stream_schedules(courses, constrained=True)), number)
+    return results
+
+
+def bench_storage(schedules: list[Schedule], number: int = 5) -> dict:
+    """Compares the size and load times of the JSON and binary formats."""
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        json_path = os.path.join(folder, 'sorted_schedules.json')
+        binary_path = os.path.join(folder, 'sorted_schedules.bin')
+        with open(json_path, 'w') as f:
+            json.dump([schedule.to_dictionary() for schedule in schedules], f)
+        with open(json_path) as read_file, \
+             open(binary_path, 'wb') as write_file:
+            store.json_to_binary(read_file, write_file)
+        results['json bytes'] = os.path.getsize(json_path)
+        results['binary bytes'] = os.path.getsize(binary_path)
+
+        def load_json():
+            with open(json_path) as f:
+                return [Schedule.from_dictionary(d) for d in json.load(f)]
+
+        def load_binary():
+            with open(binary_path, 'rb') as f, store.ScheduleReader(f) as r:
+                return list(r)
+
+        def load_binary_page():
+            with open(binary_path, 'rb') as f, store.ScheduleReader(f) as r:
+                return r[len(r) // 2:len(r) // 2 + 5]
+
+        results['load json'] = timed(load_json, number)
+        results['load binary'] = timed(load_binary, number)
+        results['binary page'] = timed(load_binary_page, number)
+    return results
+
+
+def bench_filters(schedules: list[Schedule], number: int = 5) -> dict:
+    """Times each kind of filter by scanning and through the index, and
+    sets of filters as a chain of predicates and compiled. schedules must
+    be sorted by score.
+    """
+    filters = [('time', [], {'start': '1000', 'end': '1800'}),
+               ('score', [1], {}),
+               ('courses_I', [schedules[0].sections[0].course], {}),
+               ('courses_X', [schedules[0].sections[0].course], {}),
+               ('sections_I', [[schedules[0].sections[0].course,
+                                schedules[0].sections[0].section]], {}),
+               ('sections_X', [[schedules[0].sections[0].course,
+                                schedules[0].sections[0].section]], {})]
+    results = {}
+    results['build index'] = timed(
+        lambda: ScheduleIndex(schedules), number)
+    index = ScheduleIndex(schedules)
+    for kind, args, kwargs in filters:
+        f = Filterer()
+        f.add(kind, args, kwargs)
+        results[kind + ' scan'] = timed(
+            lambda: list(filter(f.filter, schedules)), number)
+        results[kind + ' index'] = timed(
+            lambda: bitmap_to_ids(f.select(index)), number)
+    # all of them at once, as a chain of predicates and compiled
+    layered = layer_filters(*[make_filter(kind, *args, **kwargs)
+                              for kind, args, kwargs in filters])
+    f = Filterer()
+    for kind, args, kwargs in filters:
+        f.add(kind, args, kwargs)
+    f.compile(schedules)
+    results['all layered'] = timed(
+        lambda: list(filter(layered, schedules)), number)
+    results['all compiled'] = timed(
+        lambda: list(filter(f.filter, schedules)), number)
+    # listed costliest and least selective first, which compiling reorders:
+    # a section few schedules have, a time every schedule passes and the
+    # score of the top 2% of schedules
+    last = schedules[-1].sections[0]
+    worst_first = [('sections_X', [[last.course, last.section]], {}),
+                   ('time', [], {'start': '0000'}),
+                   ('score', [schedules[len(schedules) // 50].score], {})]
+    layered = layer_filters(*[make_filter(kind, *args, **kwargs)
+                              for kind, args, kwargs in worst_first])
+    f = Filterer()
+    for kind, args, kwargs in worst_first:
+        f.add(kind, args, kwargs)
+    f.compile(schedules)
+    results['worst first layered'] = timed(
+        lambda: list(filter(layered, schedules)), number)
+    results['worst first compiled'] = timed(
+        lambda: list(filter(f.filter, schedules)), number)
+    return results
+
+
+def bench_arrays(schedules: list[Schedule], sections: list[Section],
+                 size: int = 10**6, number: int = 5) -> dict:
+    """Compares filtering, scoring and sorting size schedules (the given
+    ones repeated) as objects and as a ScheduleArray. Needs numpy.
+    """
+    import arrays
+    import numpy as np
+    repeats = -(-size // len(schedules))
+    many = (schedules * repeats)[:size]
+    small = arrays.ScheduleArray.from_schedules(schedules, sections)
+    array = arrays.ScheduleArray(
+        sections, np.tile(small.score, repeats)[:size],
+        np.tile(small.start, repeats)[:size],
+        np.tile(small.end, repeats)[:size],
+        np.tile(small.membership, (repeats, 1))[:size])
+    f = Filterer()
+    f.add('time', [], {'start': '0900', 'end': '1800'})
+    f.add('score', [1])
+    f.add('courses_X', [sections[0].course])
+    results = {}
+    results['filter objects'] = timed(
+        lambda: [s for s in many if f.filter(s)], number)
+    results['filter array'] = timed(
+        lambda: array.select(f), number)
+    results['score objects'] = timed(
+        lambda: [s.updateScore() for s in many[:size // 10]], number) * 10
+    results['score array'] = timed(array.rescore, number)
+    results['sort objects'] = timed(
+        lambda: sorted(many, key = lambda s: s.score, reverse = True), number)
+    results['sort array'] = timed(array.order, number)
+    return results
+
+
+def bench_memory(schedules: list[Schedule], sections: list[Section],
+                 size: int = 10**6) -> dict:
+    """Measures the memory (in MB) of size schedules (the given ones
+    repeated) as Schedule objects and as CompactSchedule objects.
+    On a synthetic catalog of 12 courses, where schedules have about seven
+    sections, 10^6 of them take about 270 MB as Schedule objects and 100 MB
+    as CompactSchedule objects.
+    """
+    catalog = Catalog(sections)
+    repeats = -(-size // len(schedules))
+    many = (schedules * repeats)[:size]
+    results = {}
+
+    tracemalloc.start()
+    objects = [Schedule(s.sections, s.score, s.start_time, s.end_time)
+               for s in many]
+    results['Schedule MB'] = tracemalloc.get_traced_memory()[0] / 2**20
+    del objects
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    compacts = [CompactSchedule.from_schedule(s, catalog) for s in many]
+    results['CompactSchedule MB'] = tracemalloc.get_traced_memory()[0] / 2**20
+    del compacts
+    tracemalloc.stop()
+    return results
+
+
+def bench_sort(scored: list[tuple[Schedule, int]],
+               courses: list[list[Section]], number: int = 5) -> dict:
+    """Times sorting the generated schedules by float score, and by the
+    exact scores the search gives with them (see stream_scored) with each
+    tie break. Checks that get_top_schedules gives the start of each of
+    those orders first.
+    """
+    schedules = [schedule for schedule, _ in scored]
+    for tie_break in TIE_BREAKS:
+        ordered = bucket_sort(scored, courses, tie_break)
+        for k in (1, 5, 50):
+            top = get_top_schedules(k, courses, tie_break)
+            assert ([s.to_dictionary() for s in top]
+                    == [s.to_dictionary() for s in ordered[:k]]), \
+                (tie_break, k)
+
+    results = {'sort': timed(lambda: sorted(schedules,
+                                            key = lambda sched: sched.score,
+                                            reverse = True), number)}
+    for tie_break in TIE_BREAKS:
+        results['buckets ' + tie_break] = timed(
+            lambda: bucket_sort(scored, courses, tie_break), number)
+    return results
+
+
+def bench_json(schedules: list[Schedule], number: int = 5) -> dict:
+    """Times the streaming JSON round trip."""
+    f = StringIO()
+    write_json_array((schedule.to_dictionary() for schedule in schedules), f)
+    text = f.getvalue()
+    results = {}
+    results['json write'] = timed(
+        lambda: write_json_array((schedule.to_dictionary()
+                                  for schedule in schedules), StringIO()),
+        number)
+    results['json read'] = timed(
+        lambda: list(readJSON(StringIO(text))), number)
+    return results
+
+
+def bench_pages(schedules: list[Schedule], number: int = 5) -> dict:
+    """Times rendering browser pages, unfiltered and filtered."""
+    f = Filterer()
+    f.add('courses_I', [schedules[0].sections[0].course])
+    index = ScheduleIndex(schedules)
+    view = f.view(schedules, index)
+    results = {}
+    results['first page'] = timed(lambda: make_page(schedules, 0), number)
+    results['middle page'] = timed(
+        lambda: make_page(schedules, len(schedules) // 2), number)
+    results['filtered page'] = timed(
+        lambda: make_page(f.view(schedules, index), len(view) // 2), number)
+    return results
+
+
+def print_results(results: dict):
+    for name, value in results.items():
+        if name.endswith('bytes'):
+            print('{:<24}{}'.format(name, value))
+        elif name.endswith('MB'):
+            print('{:<24}{:.1f}'.format(name, value))
+        else:
+            print('{:<24}{:.6f}s'.format(name, value))
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def last_record(path: str, catalog: dict) -> dict | None:
+    """The last recorded run on the same catalog, if any."""
+    if not os.path.exists(path):
+        return None
+    record = None
+    with open(path) as f:
+        for line in f:
+            d = json.loads(line)
+            if d['catalog'] == catalog:
+                record = d
+    return record
+
+
+def print_comparison(previous: dict, results: dict):
+    print('compared with', previous['commit'], 'on', previous['date'])
+    for suite, suite_results in results.items():
+        for name, value in suite_results.items():
+            before = previous['results'].get(suite, {}).get(name)
+            if before:
+                print('{:<16}{:<24}{:>8.2f}x'.format(suite, name,
+                                                     value / before))
+
+
+def run(courses: list[list[Section]], number: int, large: bool) -> dict:
+    """Runs every suite on courses, printing and returning the results by
+    suite.
+    """
+    results = {}
+
+    def suite(name: str, suite_results: dict):
+        print(name)
+        print_results(suite_results)
+        results[name] = suite_results
+
+    sections = [section for course in courses for section in course]
+    suite('conflicts', bench_conflicts(sections, number))
+    suite('generation', bench_generation(courses, number))
+    scored = list(stream_scored(courses))
+    schedules = [schedule for schedule, _ in scored]
+    schedules.sort(key = lambda sched: sched.score, reverse = True)
+    print(len(schedules), 'schedules')
+    if not schedules:
+        return results
+    suite('sorting', bench_sort(scored, courses, number))
+    suite('filters', bench_filters(schedules, number))
+    suite('json', bench_json(schedules, number))
+    suite('storage', bench_storage(schedules, number))
+    suite('pages', bench_pages(schedules, number))
+    if large:
+        suite('memory', bench_memory(schedules, sections))
+        if importlib.util.find_spec('numpy') is None:
+            print('numpy is not installed, skipping the array benchmark')
+        else:
+            suite('arrays', bench_arrays(schedules, sections, number=1))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scheduler on course_data.txt or on a "
+                    "synthetic catalog.")
+    parser.add_argument('--courses', type=int,
+                        help="use a synthetic catalog with this many courses")
+    parser.add_argument('--sections', type=int, default=4,
+                        help="sections per synthetic course")
+    parser.add_argument('--density', type=float, default=0.05,
+                        help="fraction of the teaching week each synthetic "
+                             "section meets for")
+    parser.add_argument('--mandatory', type=int, default=1,
+                        help="synthetic courses with priority 0")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-catalog', metavar='FOLDER',
+                        help="write the synthetic course_data.txt and "
+                             "priority.json to FOLDER and stop")
+    parser.add_argument('--number', type=int, default=5,
+                        help="runs to average each time over")
+    parser.add_argument('--large', action='store_true',
+                        help="also run the 10^6 schedule memory and array "
+                             "benchmarks")
+    parser.add_argument('--record', default=RESULTS_PATH, metavar='PATH',
+                        help="file to append the results to")
+    parser.add_argument('--no-record', action='store_true')
+    parser.add_argument('--compare', action='store_true',
+                        help="compare with the last run on the same catalog")
+    args = parser.parse_args()
+
+    if args.courses is None:
+        catalog = {'file': COURSE_DATA_PATH}
+        with open(COURSE_DATA_PATH, 'r') as f:
+            text = f.read()
+        priorities = dict(PRIORITY_D)
+    else:
+        catalog = {'courses': args.courses, 'sections': args.sections,
+                   'density': args.density, 'mandatory': args.mandatory,
+                   'seed': args.seed}
+        text, priorities = synthetic_catalog(**catalog)
+        if args.write_catalog:
+            os.makedirs(args.write_catalog, exist_ok=True)
+            with open(os.path.join(args.write_catalog,
+                                   'course_data.txt'), 'w') as f:
+                f.write(text)
+            with open(os.path.join(args.write_catalog,
+                                   'priority.json'), 'w') as f:
+                json.dump(priorities, f, indent=2)
+            return
+
+    with using_priorities(priorities):
+        courses = list(read_sections(StringIO(text)).values())
+        print('catalog:', catalog)
+        results = run(courses, args.number, args.large)
+
+    previous = last_record(args.record, catalog)
+    if args.compare and previous is not None:
+        print_comparison(previous, results)
+    if not args.no_record:
+        with open(args.record, 'a') as f:
+            date = datetime.now().isoformat(timespec='seconds')
+            f.write(json.dumps({'date': date,
+                                'commit': git_commit(),
+                                'catalog': catalog,
+                                'number': args.number,
+                                'results': results}) + '\n')
+
+
+if __name__ == "__main__":
+    main()
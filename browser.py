@@ -1,12 +1,63 @@
-from datatypes import Schedule
-from scheduler import get_sorted_schedules
-from filter import Filterer
+from anytime import AnytimeSearch
+from datatypes import PRIORITY_PATH, Schedule, Section, load_priorities
+from equivalence import ExpandedSchedules, get_expanded_schedules, has_classes
+from parse import load_catalog
+from scheduler import COURSE_DATA_PATH, exact_score, priority_scale
+from filter import (Filterer, ScheduleIndex, load_closed_sections,
+                    save_closed_sections)
+import cache
+import os
+import store
+import threading
 import time
 
 
 PAGE_SIZE = 5
+COUNT_SECONDS = 10     # give up on counting schedules after this long
 
-def make_page(schedules: list[Schedule], start, size=PAGE_SIZE):
+def load_schedules() -> list[Schedule] | store.ScheduleReader:
+    """Returns the stored sorted schedules, updating them first if the
+    course data or priorities have changed since they were written. The
+    store is memory-mapped, so only the schedules that are looked at get
+    read.
+    """
+    if is_stale():
+        print('Generating schedules...')
+        cache.update_schedules()
+    with open(store.BINARY_WRITE_PATH, 'rb') as f:
+        return store.ScheduleReader(f)
+
+def is_stale() -> bool:
+    """Whether the stored schedules are missing or older than the course
+    data or priorities."""
+    path = store.BINARY_WRITE_PATH
+    return (not os.path.exists(path)
+            or os.path.getmtime(path) < os.path.getmtime(COURSE_DATA_PATH)
+            or os.path.getmtime(path) < os.path.getmtime(PRIORITY_PATH))
+
+def count_optimal(schedules: list[Schedule] | store.ScheduleReader,
+                  closed: set[tuple[str, str]] = frozenset()) -> int:
+    """Counts the schedules without closed sections tied with the first of
+    them. They are sorted, so only those (and the ones with closed sections
+    before them) need to be read. Scores are compared exactly, since tied
+    float scores can differ (see exact_score)."""
+    scale = priority_scale()
+    best = None
+    count = 0
+    for i in range(len(schedules)):
+        schedule = schedules[i]
+        score = exact_score(schedule, scale)
+        if best is not None and score != best:
+            break
+        if closed and any((section.course, section.section) in closed
+                          for section in schedule.sections):
+            continue
+        best = score
+        count += 1
+    return count
+
+def make_page(schedules: list[Schedule] | store.ScheduleReader, start,
+              size=PAGE_SIZE):
     """Returns a page of size number of schedules starting at index
     start in the list"""
     s = ''
@@ -15,7 +66,8 @@ def make_page(schedules: list[Schedule], start, size=PAGE_SIZE):
         s += str(schedule) + '\n' + schedule.summarize_daily() +'\n'
     return s
 
-def get_schedule(schedules: list[Schedule], number: int):
+def get_schedule(schedules: list[Schedule] | store.ScheduleReader,
+                 number: int):
     """Returns the details needed to find the sections from the section number
     in the portal.
     """
@@ -25,32 +77,133 @@ def get_schedule(schedules: list[Schedule], number: int):
         s += section.course + ' ' + section.section + '\n'
     return s
 
+def start_schedules() -> tuple[list[Schedule] | store.ScheduleReader
+                               | ExpandedSchedules,
+                               AnytimeSearch | None,
+                               dict[str, list[Section]] | None]:
+    """Returns the stored sorted schedules if they are up to date, or can
+    be updated from the changes since they were stored. Otherwise, if some
+    course has sections that meet at the same times, returns all of the
+    sorted schedules at once, searched over their classes and made as they
+    are paged through (see equivalence.py), and stores them in the
+    background. If not, starts generating them in the background and
+    returns the best schedules found so far, the search and the courses it
+    searches.
+    """
+    if not is_stale():
+        return load_schedules(), None, None
+    load_priorities()
+    courses = load_catalog(COURSE_DATA_PATH)
+    if cache.can_update(courses):
+        return load_schedules(), None, None
+    # kept from the stored schedules, as cache.update_schedules does
+    tie_break = cache.manifest_tie_break(cache.read_manifest())
+    if has_classes(list(courses.values())):
+        schedules = get_expanded_schedules(list(courses.values()), tie_break)
+        # stored like a finished search, so the next start opens them at
+        # once. Not a daemon, so quitting waits for the store to be written.
+        threading.Thread(target=cache.save_schedules,
+                         args=(courses, schedules, tie_break)).start()
+        return schedules, None, None
+    # counting them can take a while too, so it happens alongside
+    search = AnytimeSearch(list(courses.values()),
+                           count_seconds=COUNT_SECONDS,
+                           tie_break=tie_break).start()
+    print('Generating schedules in the background, counting them...')
+    return search.results(), search, courses
+
+def finish_search(search: AnytimeSearch,
+                  courses: dict[str, list[Section]]) -> store.ScheduleReader:
+    """Stores the schedules of a finished search and returns them."""
+    if search.error is not None:
+        raise search.error
+    cache.save_schedules(courses, search.results(), search.tie_break)
+    with open(store.BINARY_WRITE_PATH, 'rb') as f:
+        return store.ScheduleReader(f)
+
+def make_index(schedules, closed: set[tuple[str, str]]) -> ScheduleIndex:
+    index = ScheduleIndex(schedules)
+    for course, section in closed:
+        index.close(course, section)
+    return index
+
 def main():
-    schedules = get_sorted_schedules()
+    schedules, search, courses = start_schedules()
     f = Filterer()
+    index = None    # built the first time a filter or closure is used
+    closed = set(load_closed_sections())
 
-    print('There are', len(schedules), 'schedules.')
-    optimal_schedules = [schedule for schedule in schedules
-               if schedule.score == schedules[0].score]
-    print(len(optimal_schedules), 'of them are optimal.')
+    def print_counts():
+        print('There are', len(schedules), 'schedules.')
+        if closed:
+            # only the closures, not the filters, which are counted below
+            print(index.all.bit_count(), 'of them have no closed '
+                  'sections,', count_optimal(schedules, closed),
+                  'of which are optimal.')
+        else:
+            print(count_optimal(schedules), 'of them are optimal.')
+        if f.filters:
+            print(len(f.view(schedules, index)), 'schedules pass the active '
+                  'filters.')
+
+    if search is None:
+        if closed:
+            index = make_index(schedules, closed)
+        print_counts()
 
     options_dialog = ("Type q to quit, n to see the next page, p to see the "
-                      "previous page, f to edit filters.\n"
+                      "previous page, f to edit filters, c to close a "
+                      "section that filled up or o to reopen one.\n"
                       "Type the number of a schedule to show its details.\n")
     
     print("You are now entering the browser.")
-    time.sleep(2)
 
     page_start = 0
+    refresh = False     # whether to pull the best schedules found so far
     while True:
-        filtered_schedules = list(filter(f.filter, schedules))
+        if search is not None:
+            # page through the best schedules so far until it is done. They
+            # only change on r, so paging doesn't skip or repeat any.
+            progress = str(search)
+            if search.done:
+                schedules = finish_search(search, courses)
+                search = None
+                index = None
+                print('Finished generating schedules.')
+                if closed:
+                    index = make_index(schedules, closed)
+                print_counts()
+            elif refresh and search.results() is not schedules:
+                schedules = search.results()
+                index = None
+            refresh = False
+        if type(schedules) == ExpandedSchedules and f.filters and not closed:
+            # section filters narrow the classes and the rest are tested
+            # on what is left, without making every schedule for an index
+            filtered_schedules = f.view(schedules)
+        elif f.filters or closed:
+            if index is None:
+                index = make_index(schedules, closed)
+            # cached, so paging doesn't filter again
+            filtered_schedules = f.view(schedules, index)
+        else:
+            # nothing to filter, so pages are read straight from the store
+            filtered_schedules = schedules
         print()
         print(make_page(filtered_schedules, page_start))
+        if search is not None:
+            print("Still generating: " + progress + '\n')
         if f.filters:
             print("Active filters" + '\n' + str(f) + '\n')
         else:
             print("No active filters\n")
+        if closed:
+            print("Closed sections: " + ', '.join(
+                course + ' ' + section
+                for course, section in sorted(closed)) + '\n')
         print(options_dialog)
+        if search is not None:
+            print("Type r to refresh the best schedules found so far.\n")
         inp = input()
         print()
 
@@ -76,6 +229,27 @@ def main():
                 time.sleep(1)
                 continue
         
+        elif inp == 'r' and search is not None:
+            refresh = True
+            page_start = 0
+            continue
+
+        elif inp in ('c', 'o'):
+            course = input("Course code: ")
+            section = input("Section code: ")
+            if index is None:
+                index = make_index(schedules, closed)
+            if inp == 'c':
+                closed.add((course, section))
+                index.close(course, section)
+            else:
+                closed.discard((course, section))
+                index.reopen(course, section)
+            save_closed_sections(closed)
+            print(len(f.view(schedules, index)), 'schedules left.')
+            page_start = 0
+            continue
+
         elif inp == 'f':
             print("Would you like to add a filter, remove a filter, or clear "
                   "all filters? (enter add, rem, or clr)")
@@ -129,7 +303,7 @@ def main():
                             break
                         else:
                             section = input("Section code: ")
-                            args += [course, section]
+                            args += [[course, section]]
                     f.add(kind, args)
 
                 else:
@@ -163,13 +337,15 @@ def main():
             time.sleep(1)
             continue
 
-while True:
-    try:
-        if main() == 0:
-            break
-    except:
-        inp = input("An error occurred. Press enter to restart or q to quit.")
-        if inp.lower() == 'q':
-            break
-        else:
-            continue
+if __name__ == "__main__":
+    while True:
+        try:
+            if main() == 0:
+                break
+        except:
+            inp = input("An error occurred. "
+                        "Press enter to restart or q to quit.")
+            if inp.lower() == 'q':
+                break
+            else:
+                continue
@@ -0,0 +1,180 @@
+"""Incremental regeneration of the stored schedules.
+
+Next to the binary store (see store.py), a manifest records the priorities,
+the tie break the schedules are ordered by (see scheduler.TIE_BREAKS) and,
+for every course, a hash of its sections along with the sections
+themselves. When course_data.txt or priority.json changes, only what the
+change affects is redone:
+* a priority change rescores and resorts the stored schedules
+* a removed section (or course) drops the schedules that include it
+* an added section (or course) enumerates only the schedules including it
+Changing which courses are mandatory changes which schedules are possible
+at all, so that still regenerates everything.
+"""
+
+from datatypes import Schedule, Section, PRIORITY_D, load_priorities
+from parse import load_catalog
+from scheduler import (make_conflict_matrix, iter_schedules,
+                       get_sorted_schedules, sort_schedules,
+                       COURSE_DATA_PATH)
+import hashlib
+import json
+import os
+import store
+
+CACHE_PATH = os.path.join('data', 'schedule_cache.json')
+TEMP_SUFFIX = '.tmp'
+
+
+def section_line(section: Section) -> str:
+    """Identifies a section by everything about it, in the format of its
+    line in course_data.txt.
+    """
+    return '{} {} {}-{}'.format(section.section, ''.join(section.days),
+                                section.start_time.strftime('%H%M'),
+                                section.end_time.strftime('%H%M'))
+
+
+def course_hash(course: str, sections: list[Section]) -> str:
+    """The content hash of a course and its sections."""
+    text = '\n'.join([course] + [section_line(s) for s in sections])
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def make_manifest(courses: dict[str, list[Section]],
+                  tie_break: str = 'generation') -> dict:
+    return {'priorities': dict(PRIORITY_D),
+            'tie_break': tie_break,
+            'courses': {course: {'hash': course_hash(course, sections),
+                                 'sections': [section_line(section)
+                                              for section in sections]}
+                        for course, sections in courses.items()}}
+
+
+def mandatory_courses(courses, priorities: dict) -> set[str]:
+    return set(course for course in courses if priorities[course] == 0)
+
+
+def regenerate(courses: dict[str, list[Section]],
+               manifest: dict) -> list[Schedule] | None:
+    """Updates the stored schedules to match courses and the current
+    priorities, keeping the manifest's tie break, or returns None if they
+    need to be regenerated from scratch.
+    """
+    old_courses = manifest['courses']
+    if (mandatory_courses(old_courses, manifest['priorities'])
+            != mandatory_courses(courses, PRIORITY_D)):
+        return None
+
+    # find the sections that were removed or added in the changed courses
+    removed: set[tuple[str, str]] = set()
+    added: list[Section] = []
+    for course, old in old_courses.items():
+        if course not in courses:
+            removed.update((course, line) for line in old['sections'])
+    for course, sections in courses.items():
+        old = old_courses.get(course)
+        if old is not None and old['hash'] == course_hash(course, sections):
+            continue
+        old_lines = set(old['sections']) if old is not None else set()
+        new_lines = set(section_line(section) for section in sections)
+        removed.update((course, line) for line in old_lines - new_lines)
+        added += [section for section in sections
+                  if section_line(section) not in old_lines]
+
+    course_list = list(courses.values())
+    course_index = {course: i for i, course in enumerate(courses)}
+    current = {(section.course, section_line(section)): section
+               for sections in course_list for section in sections}
+
+    # keep the stored schedules that are still possible (sort_schedules
+    # rescores them)
+    schedules = []
+    with open(store.BINARY_WRITE_PATH, 'rb') as f, \
+         store.ScheduleReader(f) as reader:
+        for stored in reader:
+            keys = [(section.course, section_line(section))
+                    for section in stored.sections]
+            if any(key in removed for key in keys):
+                continue
+            schedules.append(Schedule([current[key] for key in keys]))
+
+    # enumerate only the schedules with an added section. Each added
+    # section excludes the ones before it, so no schedule is made twice.
+    matrix, allowed = make_conflict_matrix(course_list)
+    for section in added:
+        bit, compatible = matrix[section]
+        i = course_index[section.course]
+        rest = course_list[:i] + course_list[i + 1:]
+        schedules += iter_schedules(Schedule().add(section), rest, matrix,
+                                    allowed & compatible)
+        allowed &= ~bit
+
+    # sort_schedules remakes them with their sections in course order
+    return sort_schedules(schedules, course_list,
+                          manifest_tie_break(manifest))
+
+
+def manifest_tie_break(manifest: dict | None) -> str:
+    """The tie break of the stored schedules (manifests from before it was
+    recorded are in generation order).
+    """
+    if manifest is None:
+        return 'generation'
+    return manifest.get('tie_break', 'generation')
+
+
+def read_manifest() -> dict | None:
+    """The manifest of the stored schedules, if there are both."""
+    if os.path.exists(CACHE_PATH) and os.path.exists(store.BINARY_WRITE_PATH):
+        with open(CACHE_PATH) as f:
+            return json.load(f)
+    return None
+
+
+def can_update(courses: dict[str, list[Section]]) -> bool:
+    """Whether regenerate can update the stored schedules to courses and
+    the current priorities, rather than generating them from scratch.
+    """
+    manifest = read_manifest()
+    return (manifest is not None
+            and mandatory_courses(manifest['courses'], manifest['priorities'])
+                == mandatory_courses(courses, PRIORITY_D))
+
+
+def update_schedules() -> list[Schedule]:
+    """Brings the stored schedules up to date with course_data.txt and
+    priority.json, redoing as little as possible, and returns them.
+    """
+    load_priorities()
+    courses = load_catalog(COURSE_DATA_PATH)
+
+    schedules = None
+    manifest = read_manifest()
+    tie_break = manifest_tie_break(manifest)
+    if manifest is not None:
+        schedules = regenerate(courses, manifest)
+    if schedules is None:
+        schedules = get_sorted_schedules(tie_break=tie_break)
+    save_schedules(courses, schedules, tie_break)
+    return schedules
+
+
+def save_schedules(courses: dict[str, list[Section]],
+                   schedules: list[Schedule],
+                   tie_break: str = 'generation'):
+    """Stores schedules, sorted and generated from courses with tie_break,
+    along with the manifest to update them from later.
+
+    Both are written to temporary files and then moved into place, so a
+    reader still memory-mapping the old store keeps reading the old file.
+    """
+    sections = [section for course in courses.values() for section in course]
+    store_temp = store.BINARY_WRITE_PATH + TEMP_SUFFIX
+    with open(store_temp, 'wb') as f:
+        store.write_schedules(f, schedules, sections)
+    cache_temp = CACHE_PATH + TEMP_SUFFIX
+    with open(cache_temp, 'w') as f:
+        json.dump(make_manifest(courses, tie_break), f, indent=2)
+    os.replace(store_temp, store.BINARY_WRITE_PATH)
+    os.replace(cache_temp, CACHE_PATH)
@@ -0,0 +1,192 @@
+"""Slotted, integer-encoded variants of Section and Schedule.
+
+A CompactSection stores its days as a bit mask and its times as minutes
+since midnight, and is interned once per Catalog. A CompactSchedule only
+holds the ids of its sections in that catalog, packed into bytes, and its
+score; the catalog is kept by its class and the times are found from the
+sections. On a synthetic catalog of 12 courses, 10^6 of them take about
+100 MB against about 270 MB as Schedule objects (see
+benchmark.bench_memory). Both present the same attributes as the classes
+in datatypes, so __repr__, summarize_daily and the JSON round trip are
+shared with them.
+"""
+
+from array import array
+from datatypes import Schedule, Section, DAY_INDEX, PRIORITY_D
+from datetime import time
+from io import TextIOWrapper
+import json
+import store
+
+
+def days_to_mask(days) -> int:
+    mask = 0
+    for day in days:
+        mask |= 1 << DAY_INDEX[day]
+    return mask
+
+
+def mask_to_days(mask: int) -> list[str]:
+    return [day for day, i in DAY_INDEX.items() if mask >> i & 1]
+
+
+def to_minutes(t: time) -> int:
+    return t.hour * 60 + t.minute
+
+
+def to_time(minutes: int) -> time:
+    return time(minutes // 60, minutes % 60)
+
+
+class CompactSection:
+    """A Section with days as a bit mask (M is bit 0) and times as minutes
+    since midnight.
+    """
+    __slots__ = ('id', 'course', 'section', 'day_mask', 'start', 'end')
+
+    def __init__(self, id, course, section, day_mask, start, end) -> None:
+        self.id = id                # int, position in its catalog
+        self.course = course        # str
+        self.section = section      # str
+        self.day_mask = day_mask    # int
+        self.start = start          # int
+        self.end = end              # int
+
+    @property
+    def days(self) -> list[str]:
+        return mask_to_days(self.day_mask)
+
+    @property
+    def start_time(self) -> time:
+        return to_time(self.start)
+
+    @property
+    def end_time(self) -> time:
+        return to_time(self.end)
+
+    __repr__ = Section.__repr__
+    is_mandatory = Section.is_mandatory
+    to_dictionary = Section.to_dictionary
+    toJSON = Section.toJSON
+
+
+class Catalog:
+    """Interns sections, so that each one is stored once and referred to
+    by its id. Its schedules are made with its schedule_class, which holds
+    the catalog so they don't have to.
+    """
+    def __init__(self, sections: list[Section] = []):
+        self.sections: list[CompactSection] = []
+        self.ids: dict[tuple[str, str], int] = {}
+        self.schedule_class = type('CompactSchedule', (CompactSchedule,),
+                                   {'__slots__': (), 'catalog': self})
+        for section in sections:
+            self.intern(section)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __getitem__(self, id: int) -> CompactSection:
+        return self.sections[id]
+
+    def intern(self, section: Section | CompactSection) -> int:
+        """Returns the id of section, adding it if it is new."""
+        key = store.section_key(section)
+        if key not in self.ids:
+            if len(self.sections) >= MAX_SECTIONS:
+                raise ValueError("Too many sections for a catalog: "
+                                 + str(len(self.sections) + 1))
+            self.ids[key] = len(self.sections)
+            self.sections.append(CompactSection(
+                len(self.sections), section.course, section.section,
+                days_to_mask(section.days), to_minutes(section.start_time),
+                to_minutes(section.end_time)))
+        return self.ids[key]
+
+
+# ids are packed as unsigned shorts
+MAX_SECTIONS = 2**16
+
+
+class CompactSchedule:
+    """A Schedule holding the ids of its sections in a catalog, packed
+    into bytes, and its score. Its times are found from its sections when
+    asked for. Make them with the schedule_class of a Catalog, which holds
+    the catalog, or with from_schedule.
+    """
+    __slots__ = ('packed', 'score')
+    catalog: Catalog
+
+    def __init__(self, ids: tuple[int, ...] = (), score: float = 0):
+        self.packed = array('H', ids).tobytes()     # bytes
+        self.score = score                          # float
+
+    @property
+    def ids(self) -> tuple[int, ...]:
+        return tuple(memoryview(self.packed).cast('H'))
+
+    @property
+    def sections(self) -> list[CompactSection]:
+        return [self.catalog[id] for id in memoryview(self.packed).cast('H')]
+
+    @property
+    def start(self) -> int | None:
+        sections = self.sections
+        return min(s.start for s in sections) if sections else None
+
+    @property
+    def end(self) -> int | None:
+        sections = self.sections
+        return max(s.end for s in sections) if sections else None
+
+    @property
+    def start_time(self) -> time:
+        return to_time(self.start)
+
+    @property
+    def end_time(self) -> time:
+        return to_time(self.end)
+
+    def __len__(self):
+        return len(self.packed) // 2
+
+    __repr__ = Schedule.__repr__
+    summarize_daily = Schedule.summarize_daily
+    to_dictionary = Schedule.to_dictionary
+    toJSON = Schedule.toJSON
+
+    def add(self, section: Section | CompactSection):
+        """Returns a new schedule with section added."""
+        id = self.catalog.intern(section)
+        ids = self.ids
+        if id in ids:
+            return self
+        score = self.score
+        if PRIORITY_D[section.course] != 0:
+            score += float(1 / PRIORITY_D[section.course])
+        return type(self)(ids + (id,), score)
+
+    @classmethod
+    def from_schedule(cls, schedule: Schedule, catalog: Catalog):
+        ids = tuple(catalog.intern(section) for section in schedule.sections)
+        return catalog.schedule_class(ids, schedule.score)
+
+    def to_schedule(self) -> Schedule:
+        return Schedule([Section(s.course, s.section, s.days,
+                                 [s.start_time, s.end_time])
+                         for s in self.sections],
+                        self.score, self.start_time, self.end_time)
+
+    @classmethod
+    def from_dictionary(cls, d: dict, catalog: Catalog):
+        """Returns a compact schedule from the output of to_dictionary,
+        interning its sections in catalog.
+        """
+        return cls.from_schedule(Schedule.from_dictionary(d), catalog)
+
+    @classmethod
+    def fromJSON(cls, src: TextIOWrapper | str, catalog: Catalog):
+        """Returns a compact schedule from a json object."""
+        if type(src) == TextIOWrapper:
+            src = src.read()
+        return cls.from_dictionary(json.loads(src), catalog)
@@ -1,14 +1,102 @@
-"""Minify and un-minify json files."""
+"""Minify and un-minify json files.
+
+The files are JSON arrays, which are read and written one item at a time
+so that converting them takes constant memory.
+"""
 
 from io import TextIOWrapper
+from typing import Any, Iterable, Iterator
 import json
 import os
 
 ORIGINAL_PATH = os.path.join('data', 'sorted_schedules.json')
 MINIFY_PATH = os.path.join('data', 'minified_sorted_schedules.json')
+CHUNK_SIZE = 1 << 16
+
+def iter_json_array(read_file: TextIOWrapper,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yields the items of the JSON array in read_file one at a time,
+    reading it in chunks.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = read_file.read(chunk_size)
+        if chunk == '':
+            eof = True
+        buffer += chunk
+
+    def skip(chars):
+        # drop leading whitespace and chars, reading more when needed
+        nonlocal buffer
+        while True:
+            stripped = buffer.lstrip()
+            if stripped[:1] and stripped[0] in chars:
+                buffer = stripped[1:]
+                return stripped[0]
+            if stripped or eof:
+                buffer = stripped
+                return ''
+            buffer = stripped
+            fill()
+
+    if skip('[') != '[':
+        raise ValueError("Not a JSON array")
+    first = True
+    while True:
+        if not first:
+            sep = skip(',]')
+            if sep == ']':
+                return
+            if sep != ',':
+                raise ValueError("Malformed JSON array")
+        elif skip(']') == ']':
+            return
+        first = False
+        skip('')
+        # decode the next item, reading more until it is complete
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            following = buffer[end:].lstrip()[:1]
+            if following not in (',', ']') and not eof:
+                # the item may continue into the next chunk, like a number
+                fill()
+                continue
+            break
+        buffer = buffer[end:]
+        yield item
+
+def write_json_array(items: Iterable[Any], write_file: TextIOWrapper,
+                     indent: int | None = None):
+    """Writes items as a JSON array one at a time, exactly as
+    json.dump(list(items), write_file, indent=indent) would.
+    """
+    if indent is None:
+        start, separator, end = '[', ', ', ']'
+    else:
+        start, separator, end = '[\n', ',\n', '\n]'
+    wrote = False
+    for item in items:
+        if indent is None:
+            s = json.dumps(item)
+        else:
+            s = json.dumps(item, indent=indent)
+            s = ' ' * indent + s.replace('\n', '\n' + ' ' * indent)
+        write_file.write((separator if wrote else start) + s)
+        wrote = True
+    write_file.write(end if wrote else '[]')
 
 def minify(read_file: TextIOWrapper, write_file: TextIOWrapper):
-    json.dump(json.load(read_file), write_file)
+    write_json_array(iter_json_array(read_file), write_file)
 
 def expand(read_file: TextIOWrapper, write_file: TextIOWrapper, indent: int =2):
-    json.dump(json.load(read_file), write_file, indent=indent)
+    write_json_array(iter_json_array(read_file), write_file, indent=indent)
@@ -0,0 +1,94 @@
+"""Counting schedules without making them.
+
+The number of ways to finish a schedule from a given course on only
+depends on which sections of the courses left are still compatible with
+it, so the counts are memoized on that and each state is counted once,
+however many partial schedules reach it. Scores are added up exactly, as
+integers in units of 1 / (the least common multiple of the priorities),
+so schedules with equal scores are always counted together.
+"""
+
+from datatypes import Section
+from scheduler import make_conflict_matrix, read_courses, scaled_weights
+from fractions import Fraction
+import time
+
+
+def count_by_score(courses: list[list[Section]],
+                   deadline: float | None = None) -> dict[Fraction, int]:
+    """Returns the number of non-empty schedules that can be made from
+    courses at each exact score.
+    The number of states can grow exponentially on catalogs with many
+    conflicts, so if a deadline (a time.perf_counter() time) is given,
+    counting stops with a TimeoutError once it passes.
+    """
+    courses = [course for course in courses if course]
+    matrix, allowed = make_conflict_matrix(courses)
+    # the sections of each course and of all the courses after it
+    rest = [0] * (len(courses) + 1)
+    for i in range(len(courses) - 1, -1, -1):
+        rest[i] = rest[i + 1]
+        for section in courses[i]:
+            rest[i] |= matrix[section][0]
+    scale, course_weights = scaled_weights(courses)
+    weights = [course_weights[course[0].course] for course in courses]
+    memo: dict[tuple[int, int], dict[int, int]] = {}
+
+    def count(i: int, allowed: int) -> dict[int, int]:
+        # the counts of the ways to add courses i onward, by score added
+        # (in units of 1 / scale)
+        if i == len(courses):
+            return {0: 1}
+        key = (i, allowed & rest[i])
+        if key in memo:
+            return memo[key]
+        if deadline is not None and time.perf_counter() > deadline:
+            raise TimeoutError("counting the schedules took too long")
+        counts: dict[int, int] = {}
+        chosen: dict[int, int] = {}
+        for section in courses[i]:
+            bit, compatible = matrix[section]
+            if allowed & bit:
+                for score, n in count(i + 1, allowed & compatible).items():
+                    chosen[score] = chosen.get(score, 0) + n
+        for score, n in chosen.items():
+            counts[score + weights[i]] = n
+        if not courses[i][0].is_mandatory():
+            for score, n in count(i + 1, allowed).items():
+                counts[score] = counts.get(score, 0) + n
+        memo[key] = counts
+        return counts
+
+    counts = dict(count(0, allowed))
+    # the empty schedule is possible without mandatory courses, but isn't
+    # one that's generated
+    if not any(course[0].is_mandatory() for course in courses):
+        counts[0] -= 1
+        if counts[0] == 0:
+            del counts[0]
+    return {Fraction(score, scale): n for score, n in counts.items()}
+
+
+def count_schedules(courses: list[list[Section]] | None = None,
+                    deadline: float | None = None) -> dict:
+    """Returns the total number of schedules get_sorted_schedules would
+    make from courses (read from course_data.txt if not given), the number
+    at each score from best to worst, and the number tied for the best.
+    See count_by_score for the deadline.
+    """
+    if courses is None:
+        courses = read_courses()
+    counts = count_by_score(courses, deadline)
+    by_score = {score: counts[score] for score in sorted(counts,
+                                                         reverse=True)}
+    return {'total': sum(by_score.values()),
+            'by score': by_score,
+            'optimal': next(iter(by_score.values()), 0)}
+
+
+if __name__ == "__main__":
+    counts = count_schedules()
+    print('There are', counts['total'], 'schedules.')
+    print(counts['optimal'], 'of them are optimal.')
+    for score, n in counts['by score'].items():
+        print('{:<10.4f}{}'.format(float(score), n))
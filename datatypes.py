@@ -3,13 +3,64 @@ import json
 import os
 from io import TextIOWrapper
 from itertools import zip_longest
+from profiling import PROFILE
+from typing import Iterator
 
 DATA_FOLDER = 'data'
 PRIORITY_PATH = os.path.join(DATA_FOLDER, 'priority.json')
-PRIORITY_D: dict
+PRIORITY_D: dict = {}
+
+
+def load_priorities():
+    """(Re)reads priority.json into PRIORITY_D. The dictionary is updated
+    in place so every module that imported it sees the new priorities.
+    """
+    with open(PRIORITY_PATH) as f:
+        priorities = json.load(f)
+    PRIORITY_D.clear()
+    PRIORITY_D.update(priorities)
+
+
+load_priorities()
+
+# Occupancy bitsets: every section is turned into an int with one bit per
+# minute of the week, so conflict checks are a single AND. Times are whole
+# minutes, so this is exact; coarser slots would make sections that don't
+# overlap (10:50 and 10:51) share one.
+SLOTS_PER_DAY = 24 * 60
+DAY_INDEX = {day: i for i, day in enumerate('MTWRFSU')}
+# Coarse bitsets have one bit per hour of the week instead. They are small
+# enough for every schedule to keep the OR of its sections', and sections
+# that share no hour can't conflict, so most checks stop there.
+HOURS_PER_DAY = 24
+
+
+def occupancy_mask(days, start_time: time, end_time: time) -> int:
+    """Returns the week-long bitset of the minutes a meeting occupies.
+    Both the start and end minutes are included, so that sections that
+    touch (one ends when the other starts) conflict, as they always have.
+    """
+    first = start_time.hour * 60 + start_time.minute
+    last = end_time.hour * 60 + end_time.minute
+    day_mask = ((1 << (last - first + 1)) - 1) << first
+    mask = 0
+    for day in days:
+        mask |= day_mask << (DAY_INDEX[day] * SLOTS_PER_DAY)
+    return mask
+
+
+def coarse_mask(days, start_time: time, end_time: time) -> int:
+    """Returns the week-long bitset of the hours a meeting is in any part
+    of (see occupancy_mask).
+    """
+    first = start_time.hour
+    last = end_time.hour
+    day_mask = ((1 << (last - first + 1)) - 1) << first
+    mask = 0
+    for day in days:
+        mask |= day_mask << (DAY_INDEX[day] * HOURS_PER_DAY)
+    return mask
 
-with open(PRIORITY_PATH) as f:
-    PRIORITY_D = json.load(f)
 
 class Section:
     """Represents a section of a course, with course code, section
@@ -21,6 +72,10 @@ class Section:
         self.days = days            # list[str]
         self.start_time: time = times[0]    # time
         self.end_time: time = times[1]      # time
+        self.occupancy = occupancy_mask(days, self.start_time,
+                                        self.end_time)  # int
+        self.coarse = coarse_mask(days, self.start_time,
+                                  self.end_time)        # int
     
     def __repr__(self):
         # if len(self.section) < 3:
@@ -38,38 +93,16 @@ class Section:
         """
         Returns true if the calling section conflicts with the schedule
         """
-        pass
-        if type(other) == Section:
-            # first check days
-            sameDay = False
-            for selfDay in self.days:
-                for otherDay in other.days:
-                    if selfDay == otherDay:
-                        sameDay = True
-                        break
-                if sameDay:
-                    break
-            if not sameDay:
-                return False
-            
-            # then times
-            if (self.start_time >= other.start_time
-                and self.start_time <= other.end_time):
-                return True
-            if (other.start_time >= self.start_time
-                and other.start_time <= self.end_time):
-                return True
-            return False
-        
-        elif type(other) == Schedule:
-            for section in other.sections:
-                if self.conflicts_with(section):
-                    return True
-            return False
-        
-        else:
+        if PROFILE.enabled:
+            PROFILE.count('conflicts_with')
+        if not isinstance(other, (Section, Schedule)):
             raise TypeError("Argument was not a Section or a Schedule but a "
                             + str(type(other)))
+        # a schedule keeps the OR of its sections' hours, so only one that
+        # shares an hour has its minutes made (see Schedule.occupancy)
+        if self.coarse & other.coarse == 0:
+            return False
+        return self.occupancy & other.occupancy != 0
         
     def to_dictionary(self) -> dict:
         """helper function for JSON"""
@@ -101,7 +134,11 @@ class Section:
         # convert to string if necessary and then turn into dictionary
         if type(src) == TextIOWrapper:
             src = src.read()
-        d = json.loads(src)
+        return cls.from_dictionary(json.loads(src))
+
+    @classmethod
+    def from_dictionary(cls, d: dict):
+        """Returns a section object from the output of to_dictionary"""
         # recover times as time objects
         start_time = d['start time']
         start_time = time(start_time[0], start_time[1])
@@ -116,15 +153,77 @@ class Schedule:
     """
     Represents a class schedule, with a list of sections,
     a prioritization score, and start and end times
+
+    Schedules made by add share their sections with the schedule they were
+    made from: each one only keeps a pointer to that parent and the section
+    that was added, along with its own score, times and the OR of its
+    sections' hours (see coarse_mask), so adding a section is O(1) unless
+    it shares every hour it meets in with the schedule, when checking that
+    it isn't already in it walks up the parents. The sections list is built
+    on first access.
     """
     def __init__(self, sections=[], score=0,
                  start_time=None, end_time=None):
-        self.sections: list[Section] = sections
+        self.parent: Schedule | None = None
+        self.last_section: Section | None = None
+        self._sections: list[Section] | None = list(sections)
+        self.size = len(sections)
+        self.coarse = 0
+        for section in sections:
+            self.coarse |= section.coarse
         self.score: float = score
         self.start_time: time = start_time
         self.end_time: time = end_time
-        for section in sections:
-            self.add(section, inplace=True)
+
+    @property
+    def sections(self) -> list[Section]:
+        if self._sections is None:
+            # walk up to the nearest schedule that has its list built
+            tail = []
+            schedule = self
+            while schedule._sections is None:
+                tail.append(schedule.last_section)
+                schedule = schedule.parent
+            tail.reverse()
+            self._sections = schedule._sections + tail
+        return self._sections
+
+    def iter_sections(self) -> Iterator[Section]:
+        """Yields the sections, the last added first, walking up the shared
+        sections rather than building the list.
+        """
+        schedule = self
+        while schedule._sections is None:
+            yield schedule.last_section
+            schedule = schedule.parent
+        yield from reversed(schedule._sections)
+
+    @property
+    def occupancy(self) -> int:
+        """The OR of the sections' occupancy. It is made when asked for
+        rather than kept, since a week of minutes is about a kilobyte per
+        schedule; the coarse mask that is kept rules out most conflicts
+        without it.
+        """
+        occupancy = 0
+        for section in self.iter_sections():
+            occupancy |= section.occupancy
+        return occupancy
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, section: Section):
+        # a section in any hour the schedule isn't can't be in it
+        if section.coarse & ~self.coarse:
+            return False
+        # walk up the shared sections rather than building the list
+        schedule = self
+        while schedule._sections is None:
+            if schedule.last_section == section:
+                return True
+            schedule = schedule.parent
+        return section in schedule._sections
 
     def __repr__(self, rich=False):
         s = ''
@@ -184,24 +283,45 @@ class Schedule:
     
     def copy(self):
         """Returns a copy of the schedule"""
+        if PROFILE.enabled:
+            PROFILE.count('schedule copies')
         return Schedule(self.sections.copy(), self.score,
                         self.start_time, self.end_time)
     
     def add(self, section: Section, *, inplace=False):
-        """Adds a section to the schedule"""
+        """Adds a section to the schedule.
+        Unless inplace, the schedule is left as it is and a new schedule
+        sharing its sections is returned. Don't add in place to a schedule
+        that other schedules have been made from.
+        """
+        if section in self:
+            return self if inplace else self.copy()
         if inplace:
             schedule = self
+            schedule.sections.append(section)
         else:
-            schedule = self.copy()
-            if section not in schedule.sections:
-                schedule.sections.append(section)
-                if not schedule.start_time:
-                    schedule.start_time = section.start_time
-                    schedule.end_time = section.end_time
-                else:
-                    schedule.start_time = min(schedule.start_time, section.start_time)
-                    schedule.end_time = max(schedule.end_time, section.end_time)
-                schedule.updateScore()
+            if PROFILE.enabled:
+                PROFILE.count('schedule adds')
+            schedule = Schedule()
+            schedule.parent = self
+            schedule.last_section = section
+            schedule._sections = None
+            schedule.size = self.size
+            schedule.coarse = self.coarse
+            schedule.score = self.score
+            schedule.start_time = self.start_time
+            schedule.end_time = self.end_time
+        schedule.size += 1
+        schedule.coarse |= section.coarse
+        if schedule.start_time is None:
+            schedule.start_time = section.start_time
+            schedule.end_time = section.end_time
+        else:
+            schedule.start_time = min(schedule.start_time, section.start_time)
+            schedule.end_time = max(schedule.end_time, section.end_time)
+        # same as updateScore, since sections are summed in order
+        if PRIORITY_D[section.course] != 0:
+            schedule.score += float(1 / PRIORITY_D[section.course])
         return schedule
 
     def remove(self, code, *, inplace=False):
@@ -244,15 +364,18 @@ class Schedule:
         # convert to string if necessary and then turn into dictionary
         if type(src) == TextIOWrapper:
             src = src.read()
-        # TODO: unpack sections from JSON
-        d = json.loads(src)
-        d['sections'] = [Section.fromJSON(jsonSection)
-                         for jsonSection in d['sections']]
+        return cls.from_dictionary(json.loads(src))
+
+    @classmethod
+    def from_dictionary(cls, d: dict):
+        """Returns a schedule object from the output of to_dictionary"""
+        sections = [Section.from_dictionary(section)
+                    for section in d['sections']]
         # recover times as time objects
         start_time = d['start time']
         start_time = time(start_time[0], start_time[1])
         end_time = d['end time']
         end_time = time(end_time[0], end_time[1])
         # instantiate object and return
-        args = [d['sections'], d['score'], start_time, end_time]
+        args = [sections, d['score'], start_time, end_time]
         return cls(*args)
@@ -0,0 +1,262 @@
+"""Collapsing sections with identical meeting patterns.
+
+Sections of a course that meet on the same days at the same times (like
+PZ01 and PZ02 on different campuses) are interchangeable for conflicts,
+times and score. They are grouped into equivalence classes, schedules are
+enumerated over one representative per class, and concrete schedules are
+only made when they are looked at, exported or filtered by section.
+They are listed in exactly the order get_sorted_schedules gives, which is
+what it uses when a catalog has such sections.
+"""
+
+from datatypes import Schedule, Section
+from profiling import PROFILE
+from scheduler import (read_courses, schedules_from_keys, stream_constrained,
+                       stream_scored, search_parallel, search_size,
+                       TIE_BREAKS, PARALLEL_MIN_SEARCH)
+from bisect import bisect_right
+from itertools import islice, product, repeat
+from typing import Iterator, Sequence
+import heapq
+
+
+def pattern(section: Section) -> tuple:
+    # the order the days are listed in doesn't matter
+    return (frozenset(section.days), section.start_time, section.end_time)
+
+
+def make_classes(courses: list[list[Section]]
+                 ) -> tuple[list[list[Section]], dict[Section, list[Section]]]:
+    """Groups each course's sections by meeting pattern. Returns the
+    courses with only the first section of each class, and the members of
+    each class keyed by that representative.
+    """
+    representatives = []
+    members: dict[Section, list[Section]] = {}
+    for course in courses:
+        by_pattern: dict[tuple, Section] = {}
+        for section in course:
+            key = pattern(section)
+            if key not in by_pattern:
+                by_pattern[key] = section
+                members[section] = []
+            members[by_pattern[key]].append(section)
+        representatives.append(list(by_pattern.values()))
+    return representatives, members
+
+
+def has_classes(courses: list[list[Section]]) -> bool:
+    """Whether any course has sections with the same meeting pattern."""
+    return any(len(set(map(pattern, course))) < len(course)
+               for course in courses)
+
+
+def block_size(choices: tuple[tuple[int, ...], ...]) -> int:
+    size = 1
+    for options in choices:
+        size *= len(options)
+    return size
+
+
+class ExpandedSchedules(Sequence):
+    """The concrete schedules of schedules over class representatives, in
+    the order of get_sorted_schedules, which can be paged through like a
+    list without making any but the ones asked for.
+    Sections are numbered in course order, each course followed by a
+    number that stands for skipping it, so a schedule's numbers (one per
+    course) sort in generation order. The schedules are in groups of equal
+    score, from the highest down. A group is a list of blocks, each the
+    numbers that can be chosen from each course along with what all of
+    their schedules share: score, start and end times and tie break key.
+    A block stands for every combination of its choices, and a group's
+    combinations are only put in order as far as the last one asked for.
+    """
+    def __init__(self, courses: list[list[Section]], groups: list[list],
+                 tie_break: str = 'generation'):
+        self.courses = courses
+        self.tie_break = tie_break
+        self.sections: list[Section | None] = []
+        for course in courses:
+            self.sections += course + [None]
+        self.groups = [blocks for blocks in groups if blocks]
+        # position of the first concrete schedule of each group
+        self.starts = []
+        total = 0
+        for blocks in self.groups:
+            self.starts.append(total)
+            total += sum(block_size(choices) for choices, _ in blocks)
+        self.total = total
+        # the last group read: its number, the rest of its merge and the
+        # entries merged so far
+        self.cached: tuple[int, Iterator[tuple], list[tuple]] | None = None
+
+    def expand(self, g: int) -> Iterator[tuple]:
+        """Yields the (tie break key, numbers, block) of every schedule in
+        group g, in order. Each block's combinations come out of product
+        in generation order and share a tie break key, so the blocks are
+        merged as they are read rather than sorted.
+        """
+        # numbers are distinct, so the blocks are never compared
+        return heapq.merge(*[zip(repeat(shared[3]), product(*choices),
+                                 repeat(b))
+                             for b, (choices, shared)
+                             in enumerate(self.groups[g])])
+
+    def make(self, g: int, entry: tuple) -> Schedule:
+        _, numbers, b = entry
+        score, start_time, end_time, _ = self.groups[g][b][1]
+        sections = list(filter(None, map(self.sections.__getitem__, numbers)))
+        return Schedule(sections, score, start_time, end_time)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, i: int | slice) -> Schedule | list[Schedule]:
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(self.total))]
+        if i < 0:
+            i += self.total
+        if not 0 <= i < self.total:
+            raise IndexError("schedule index out of range")
+        g = bisect_right(self.starts, i) - 1
+        if self.cached is None or self.cached[0] != g:
+            self.cached = (g, self.expand(g), [])
+        _, merge, entries = self.cached
+        position = i - self.starts[g]
+        if position >= len(entries):
+            entries += islice(merge, position + 1 - len(entries))
+        return self.make(g, entries[position])
+
+    def __iter__(self) -> Iterator[Schedule]:
+        for g in range(len(self.groups)):
+            for entry in self.expand(g):
+                yield self.make(g, entry)
+
+    def filter_sections(self, kind: str, *args) -> 'ExpandedSchedules':
+        """Returns the concrete schedules that pass a 'sections_I' or
+        'sections_X' filter (see filter.make_filter), by narrowing the
+        blocks instead of testing every concrete schedule.
+        """
+        listed = set((course, section) for course, section in args)
+
+        def is_listed(number: int):
+            section = self.sections[number]
+            return (section is not None
+                    and (section.course, section.section) in listed)
+
+        groups = []
+        for blocks in self.groups:
+            narrowed_blocks = []
+            if kind == 'sections_X':
+                for choices, shared in blocks:
+                    choices = tuple(tuple(n for n in options
+                                          if not is_listed(n))
+                                    for options in choices)
+                    if all(choices):
+                        narrowed_blocks.append((choices, shared))
+            elif kind == 'sections_I':
+                # split each block into the schedules whose first listed
+                # section is from each course, so none is counted twice
+                for choices, shared in blocks:
+                    for p, options in enumerate(choices):
+                        picks = tuple(n for n in options if is_listed(n))
+                        if not picks:
+                            continue
+                        narrowed = tuple(
+                            tuple(n for n in before if not is_listed(n))
+                            for before in choices[:p]) \
+                            + (picks,) + choices[p + 1:]
+                        if all(narrowed):
+                            narrowed_blocks.append((narrowed, shared))
+            else:
+                raise ValueError("'{}' is not a section filter.".format(kind))
+            groups.append(narrowed_blocks)
+        return ExpandedSchedules(self.courses, groups, self.tie_break)
+
+
+def search_classes(representatives: list[list[Section]], workers: int = 1,
+                   split_depth: int = 1, constrained: bool = False
+                   ) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Yields the generation order key (see schedules_from_keys) and exact
+    score of every non-empty schedule over the class representatives,
+    searching them the way get_sorted_schedules does for workers,
+    split_depth and constrained. Groups are put in order later, so the
+    order they come in doesn't matter.
+    """
+    if constrained:
+        yield from stream_constrained(representatives)
+        return
+    if workers > 1 and search_size(representatives) >= PARALLEL_MIN_SEARCH:
+        scored = search_parallel(representatives, workers, split_depth)
+    else:
+        scored = stream_scored(representatives)
+    position = {section: i for course in representatives
+                for i, section in enumerate(course)}
+    course_index = {course[0].course: i
+                    for i, course in enumerate(representatives) if course}
+    skipped = [len(course) for course in representatives]
+    for schedule, score in scored:
+        key = list(skipped)
+        for section in schedule.sections:
+            key[course_index[section.course]] = position[section]
+        yield tuple(key), score
+
+
+def get_expanded_schedules(courses: list[list[Section]] | None = None,
+                           tie_break: str = 'generation', workers: int = 1,
+                           split_depth: int = 1, constrained: bool = False
+                           ) -> ExpandedSchedules:
+    """Enumerates the schedules over equivalence classes and returns their
+    concrete schedules, to be made on demand, in the order
+    get_sorted_schedules gives for tie_break. workers, split_depth and
+    constrained choose the search, as in get_sorted_schedules.
+    """
+    if courses is None:
+        courses = read_courses()
+    representatives, members = make_classes(courses)
+    # the numbers of each class's members (see ExpandedSchedules), by the
+    # position of its representative, then the number for skipping
+    numbers = []
+    offset = 0
+    for course, course_representatives in zip(courses, representatives):
+        position = {section: offset + i for i, section in enumerate(course)}
+        numbers.append([tuple(position[member]
+                              for member in members[representative])
+                        for representative in course_representatives]
+                       + [(offset + len(course),)])
+        offset += len(course) + 1
+
+    by_score: dict[int, list[tuple[int, ...]]] = {}
+    with PROFILE.timer('generate'):
+        for key, score in search_classes(representatives, workers,
+                                         split_depth, constrained):
+            by_score.setdefault(score, []).append(key)
+    with PROFILE.timer('sort'):
+        groups = make_groups(representatives, numbers, by_score, tie_break)
+    return ExpandedSchedules(courses, groups, tie_break)
+
+
+def make_groups(representatives: list[list[Section]],
+                numbers: list[list[tuple[int, ...]]],
+                by_score: dict[int, list[tuple[int, ...]]],
+                tie_break: str) -> list[list]:
+    """The groups of an ExpandedSchedules, from the generation order keys
+    of the schedules over representatives by exact score, and the numbers
+    of each class's members (see get_expanded_schedules).
+    """
+    tie_key = TIE_BREAKS[tie_break]
+    groups = []
+    for score in sorted(by_score, reverse=True):
+        keys = by_score.pop(score)
+        blocks = []
+        # members of a class share times, so every schedule of a block has
+        # its class schedule's score, times and tie break key
+        for key, schedule in zip(keys, schedules_from_keys(
+                keys, representatives)):
+            choices = tuple(course_numbers[p] for course_numbers, p
+                            in zip(numbers, key))
+            blocks.append((choices, (schedule.score, schedule.start_time,
+                                     schedule.end_time,
+                                     tie_key(schedule) if tie_key else None)))
+        groups.append(blocks)
+    return groups
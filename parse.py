@@ -0,0 +1,201 @@
+"""Reading course catalogs.
+
+The whole file is read and parsed in one pass, collecting every error with
+its line number instead of stopping at the first one. Besides the format
+described in scheduler.read_sections, it accepts:
+* sections indented by any whitespace (or not at all)
+* times with or without a colon and leading zero, like 935-1050 or
+  09:35 - 10:50
+* days in either case and separated by commas, like M,W or mw
+* blank lines, Windows line endings and # comments
+An unindented line that starts like a section (a section code followed by
+a time, possibly after days) is reported as a malformed section rather
+than read as a course. A course without sections is reported too, unless
+its section lines already were.
+
+Parsed catalogs are cached in a JSON sidecar next to the catalog (see
+load_catalog), so reading an unchanged catalog again skips parsing.
+"""
+
+from datatypes import Section, DAY_INDEX
+import datetime
+import hashlib
+import json
+import re
+
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'CCATLG03'
+
+SECTION_LINE = re.compile(
+    r'(\S+)\s+([A-Za-z,]+)\s+(\d{1,2}):?(\d{2})\s*-\s*(\d{1,2}):?(\d{2})$')
+# how a malformed section line still starts: a section, then a time,
+# possibly after days. Days alone are not enough, since a course like
+# Physics F looks the same.
+SECTION_START = re.compile(r'\S+\s+.*?\d{1,2}:?\d{2}\s*-')
+
+
+class ParseError(ValueError):
+    """The errors found in a catalog, as (line number, message) pairs."""
+    def __init__(self, errors: list[tuple[int, str]]):
+        self.errors = errors
+        super().__init__('\n'.join('line {}: {}'.format(number, message)
+                                   for number, message in errors))
+
+
+def parse_catalog(text: str) -> dict[str, list[Section]]:
+    """Parses the text of a catalog into a dictionary of lists of Sections
+    of the same course keyed by their code. Raises a ParseError listing
+    every malformed line.
+    """
+    sections: dict[str, list[Section]] = {}
+    errors: list[tuple[int, str]] = []
+    times: dict[tuple[int, int], datetime.time] = {}    # made once each
+    seen: set[tuple[str, str]] = set()
+    headings: dict[str, int] = {}       # the line each course starts on
+    course = None
+    with_errors: set[str] = set()   # courses with malformed section lines
+
+    def error(number, message):
+        errors.append((number, message))
+        if course is not None:
+            with_errors.add(course)
+
+    def make_time(number, hour, minute):
+        key = (int(hour), int(minute))
+        if key not in times:
+            try:
+                times[key] = datetime.time(*key)
+            except ValueError:
+                error(number, "invalid time {}:{}".format(hour, minute))
+                return None
+        return times[key]
+
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.split('#', 1)[0]
+        stripped = line.strip()
+        if not stripped:
+            continue
+        match = SECTION_LINE.match(stripped)
+        if match is None:
+            if line[0].isspace() or SECTION_START.match(stripped):
+                error(number, "expected 'section days start-end', got "
+                      + repr(stripped))
+                continue
+            course = stripped
+            # a course listed again continues where it left off
+            sections.setdefault(course, [])
+            headings.setdefault(course, number)
+            continue
+
+        if course is None:
+            error(number, "section before any course")
+            continue
+        section, days, *clock = match.groups()
+        days = [day for day in days.upper() if day != ',']
+        bad_days = [day for day in days if day not in DAY_INDEX]
+        if bad_days:
+            error(number, "unknown days " + ''.join(bad_days))
+            continue
+        if len(set(days)) != len(days):
+            error(number, "repeated days " + ''.join(days))
+            continue
+        start_time = make_time(number, clock[0], clock[1])
+        end_time = make_time(number, clock[2], clock[3])
+        if start_time is None or end_time is None:
+            continue
+        if end_time < start_time:
+            error(number, "section ends before it starts")
+            continue
+        if (course, section) in seen:
+            error(number, "section {} of {} is listed twice".format(section,
+                                                                     course))
+            continue
+        seen.add((course, section))
+        sections[course].append(Section(course, section, days,
+                                        [start_time, end_time]))
+
+    for course, course_sections in sections.items():
+        # a course whose section lines were all malformed was reported
+        if not course_sections and course not in with_errors:
+            errors.append((headings[course],
+                           "course {} has no sections".format(course)))
+    if errors:
+        raise ParseError(sorted(errors))
+    return sections
+
+
+def to_records(sections: dict[str, list[Section]]) -> list:
+    """The sections as plain tuples, to be cached."""
+    return [(course, [(s.section, ''.join(s.days),
+                       s.start_time.hour, s.start_time.minute,
+                       s.end_time.hour, s.end_time.minute)
+                      for s in course_sections])
+            for course, course_sections in sections.items()]
+
+
+def from_records(records: list) -> dict[str, list[Section]]:
+    """The sections of cached records, as made by to_records."""
+    times: dict[tuple[int, int], datetime.time] = {}
+
+    def make_time(hour, minute):
+        if (hour, minute) not in times:
+            times[(hour, minute)] = datetime.time(hour, minute)
+        return times[(hour, minute)]
+
+    return {course: [Section(course, section, list(days),
+                             [make_time(h1, m1), make_time(h2, m2)])
+                     for section, days, h1, m1, h2, m2 in course_sections]
+            for course, course_sections in records}
+
+
+def read_cache(path: str) -> dict | None:
+    """The cache at path, or None if there is none or it can't be read.
+    It is JSON, so a cache written by someone else can't run code when it
+    is loaded.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                return None
+            cached = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if (type(cached) != dict
+            or not {'hash', 'records'} <= cached.keys()):
+        return None
+    return cached
+
+
+def write_cache(path: str, cached: dict):
+    """Writes cached to path, leaving it be if it can't be written."""
+    try:
+        with open(path, 'wb') as f:
+            f.write(CACHE_MAGIC)
+            f.write(json.dumps(cached, separators=(',', ':')).encode())
+    except OSError:
+        pass        # the cache is only an optimization
+
+
+def load_catalog(path: str, use_cache: bool = True
+                 ) -> dict[str, list[Section]]:
+    """Returns the parsed catalog at path, from its sidecar cache at
+    path + CACHE_SUFFIX when the catalog hasn't changed.
+    The cache is only used if the catalog's content hash matches it.
+    Modification times and sizes can stay the same across an edit, and
+    hashing the catalog is cheap next to parsing it.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not use_cache:
+        return parse_catalog(data.decode())
+    cache_path = path + CACHE_SUFFIX
+    cached = read_cache(cache_path)
+    digest = hashlib.sha256(data).hexdigest()
+    if cached is not None and cached['hash'] == digest:
+        try:
+            return from_records(cached['records'])
+        except (TypeError, ValueError, KeyError):
+            pass        # malformed, so parsed and written again
+    sections = parse_catalog(data.decode())
+    write_cache(cache_path, {'hash': digest, 'records': to_records(sections)})
+    return sections
@@ -0,0 +1,127 @@
+"""Counters and timers for the generation pipeline.
+
+Instrumentation is off by default. Turn it on with enable() (or
+python scheduler.py --profile) and read the results with summary() or
+toJSON(). Hot paths check PROFILE.enabled before counting, so leaving it
+off costs next to nothing.
+
+Counters kept:
+'search nodes'      calls of the recursive search
+'conflicts'         sections skipped because they conflict
+'bound prunes'      branches cut by get_top_schedules' bound
+'forward check prunes'  branches cut because a mandatory course has no
+                    compatible section left (constrained search)
+'conflicts_with'    calls of Section.conflicts_with
+'schedule adds'     schedules made by Schedule.add
+'schedule copies'   calls of Schedule.copy
+'schedules found'   schedules found by the search, which are schedules of
+                    class representatives when sections are collapsed
+                    (see equivalence.py)
+'schedules'         schedules returned by get_sorted_schedules
+
+Timers kept: 'parse', 'generate', 'sort' and 'serialize'. A parallel
+search merges its subtrees as they come back, which is timed as
+'generate'. Counts made in the worker processes of a parallel search are
+not included.
+"""
+
+from contextlib import contextmanager
+from io import TextIOWrapper
+import json
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:     # not on Windows
+    resource = None
+
+
+class Profile:
+    """Counters and cumulative timers, by name."""
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.counters: dict[str, int] = {}
+        self.timers: dict[str, float] = {}
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name: str):
+        """Adds the time spent in the with block to the timer name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = (self.timers.get(name, 0)
+                                 + time.perf_counter() - start)
+
+    def reset(self):
+        self.counters.clear()
+        self.timers.clear()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    def summary(self) -> dict:
+        """Returns the counters, the timers (in seconds) and the peak
+        memory (in bytes): traced by Python if enabled with trace_memory,
+        and otherwise the peak resident size of the process if known.
+        """
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+        elif resource is not None:
+            # kilobytes on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        else:
+            peak = None
+        return {'counters': dict(self.counters),
+                'timers': dict(self.timers),
+                'peak memory': peak}
+
+    def toJSON(self, f: TextIOWrapper | None = None):
+        """Serializes the summary and returns it or writes it to the opened
+        file object f, if given.
+        """
+        s = json.dumps(self.summary(), indent=2)
+        if f:
+            f.write(s)
+        else:
+            return s
+
+    def __repr__(self):
+        summary = self.summary()
+        s = ''
+        for name, n in summary['counters'].items():
+            s += '{:<20}{}\n'.format(name, n)
+        for name, seconds in summary['timers'].items():
+            s += '{:<20}{:.4f}s\n'.format(name, seconds)
+        if summary['peak memory'] is not None:
+            s += '{:<20}{:.1f}MB\n'.format('peak memory',
+                                           summary['peak memory'] / 2**20)
+        return s[:-1]
+
+
+PROFILE = Profile()
+
+
+def enable(trace_memory: bool = False):
+    """Starts counting and timing, from zero. With trace_memory, the peak
+    memory is traced by Python, which is exact but slows everything down.
+    """
+    PROFILE.enabled = True
+    PROFILE.trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    PROFILE.reset()
+
+
+def disable():
+    PROFILE.enabled = False
+    if PROFILE.trace_memory:
+        tracemalloc.stop()
+        PROFILE.trace_memory = False
@@ -1,11 +1,20 @@
-from datatypes import Schedule, Section
+from datatypes import Schedule, Section, PRIORITY_D
+from parse import load_catalog, parse_catalog
+from profiling import PROFILE
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
 from io import TextIOWrapper
-import datetime
+from math import ceil, lcm
+from operator import itemgetter
+from typing import Callable, Iterable, Iterator, Sequence
+import heapq
 import os
 
 DATA_FOLDER = 'data'
 JSON_WRITE_PATH = os.path.join(DATA_FOLDER, 'sorted_schedules.json')
 COURSE_DATA_PATH = os.path.join(DATA_FOLDER, 'course_data.txt')
+# searches with fewer possible schedules than this are never parallelized
+PARALLEL_MIN_SEARCH = 100_000
 
 
 def read_sections(f: TextIOWrapper) -> dict[str, list[Section]]:
@@ -19,85 +28,807 @@ def read_sections(f: TextIOWrapper) -> dict[str, list[Section]]:
         01 MW 0935-1050
         02 MW 1100-1215
         03 MW 1445-1600
+    Errors are reported with their line numbers in a parse.ParseError, and
+    some variations of the format are accepted (see parse.py).
     """
-    sections: dict[str, list[Section]] = {}
-    line = f.readline()
-    while line != "":   # otherwise EOF
-        if line != '\n':    # otherwise empty line
-
-            if line[0] != ' ':  # course title with no indent
-                course = line.strip()
-                sections[course] = []
-
-            else:   # indented section line under course line
-                section_data = line.split()
-                section = section_data[0]
-                days = [day for day in section_data[1]]
-                # turn the string times into time objects
-                start_time = section_data[2][:4]
-                start_time = datetime.time(int(start_time[0:2]),
-                                           int(start_time[2:4]))
-                end_time = section_data[2][5:9]
-                end_time = datetime.time(int(end_time[0:2]),
-                                         int(end_time[2:4]))
-                time = [start_time, end_time]
-                sections[course].append(Section(course, section, days, time))
-
-        line = f.readline()
-    return sections
+    return parse_catalog(f.read())
 
 
-def make_schedules(existing_schedule: Schedule,
-                  courses_to_add: list[list[Section]]) -> list[Schedule]:
-    """Makes a list of schedules that contain each course no more than
-    one time. No schedule will be made that does not include the
-    mandatory courses.
+def make_conflict_matrix(courses: list[list[Section]],
+                         existing_schedule: Schedule | None = None
+                         ) -> tuple[dict[Section, tuple[int, int]], int]:
+    """Numbers every section and precomputes which sections it is
+    compatible with, so the search never has to call conflicts_with.
+    Returns a dictionary mapping each section to its bit and the bitset of
+    the sections it does not conflict with, along with the bitset of the
+    sections that do not conflict with existing_schedule, if given.
+    """
+    flat = [section for course in courses for section in course]
+    matrix: dict[Section, tuple[int, int]] = {}
+    for i, section in enumerate(flat):
+        compatible = 0
+        for j, other in enumerate(flat):
+            if not section.conflicts_with(other):
+                compatible |= 1 << j
+        matrix[section] = (1 << i, compatible)
+    allowed = 0
+    for section, (bit, _) in matrix.items():
+        if (existing_schedule is None
+                or not section.conflicts_with(existing_schedule)):
+            allowed |= bit
+    return matrix, allowed
+
+
+def iter_schedules(existing_schedule: Schedule,
+                   courses_to_add: list[list[Section]],
+                   matrix: dict[Section, tuple[int, int]] | None = None,
+                   allowed: int = 0,
+                   should_stop: Callable[[], bool] | None = None
+                   ) -> Iterator[Schedule]:
+    """Yields, one at a time, every schedule that contains each course no
+    more than one time. No schedule will be made that does not include the
+    mandatory courses. Only the current branch of the recursion is held in
+    memory.
+    matrix and allowed come from make_conflict_matrix and are built on
+    the first call if not given. allowed is the bitset of the sections that
+    are still compatible with every section in existing_schedule.
+    If given, should_stop is called at every node of the search, and the
+    search ends early once it returns True.
+    """
+    for schedule, _ in iter_scored_schedules(existing_schedule,
+                                             courses_to_add,
+                                             [0] * len(courses_to_add), 0,
+                                             matrix, allowed, should_stop):
+        yield schedule
+
+
+def iter_scored_schedules(existing_schedule: Schedule,
+                          courses_to_add: list[list[Section]],
+                          weights: list[int], score: int = 0,
+                          matrix: dict[Section, tuple[int, int]] | None = None,
+                          allowed: int = 0,
+                          should_stop: Callable[[], bool] | None = None
+                          ) -> Iterator[tuple[Schedule, int]]:
+    """The search of iter_schedules, yielding each schedule along with its
+    exact score (see exact_score). weights has what each course of
+    courses_to_add adds to a score (see scaled_weights) and score is the
+    exact score of existing_schedule. The scores are summed as the search
+    goes, so no schedule's sections are ever added up again.
     """
+    if PROFILE.enabled:
+        PROFILE.count('search nodes')
+    if should_stop is not None and should_stop():
+        return
     if courses_to_add == []:          # bottom of recursion
-        return [existing_schedule]
+        yield existing_schedule, score
+        return
+    if matrix is None:
+        matrix, allowed = make_conflict_matrix(courses_to_add,
+                                               existing_schedule)
     
     # each subtree includes one of the sections of that course
-    new_schedules = []
     for section in courses_to_add[0]: # from the current course group to add
-        if not section.conflicts_with(existing_schedule):
-            # add to the list all of the schedules that can be made by
-            # including that section
+        bit, compatible = matrix[section]
+        if allowed & bit:
+            # yield all of the schedules that can be made by including that
+            # section
             # this relies on add not being in place
-            new_schedules += make_schedules(existing_schedule.add(section),
-                                            courses_to_add[1:])
+            yield from iter_scored_schedules(existing_schedule.add(section),
+                                             courses_to_add[1:], weights[1:],
+                                             score + weights[0], matrix,
+                                             allowed & compatible,
+                                             should_stop)
+        elif PROFILE.enabled:
+            PROFILE.count('conflicts')
     # we also consider not adding the course at all, unless mandatory
     if not section.is_mandatory():
-        new_schedules += make_schedules(existing_schedule, courses_to_add[1:])
-    # now we have reached the end of the recursion and newSchedules has
-    # every possible schedule
-    return new_schedules
+        yield from iter_scored_schedules(existing_schedule,
+                                         courses_to_add[1:], weights[1:],
+                                         score, matrix, allowed, should_stop)
+
+
+def iter_schedules_constrained(courses: list[list[Section]],
+                               matrix: dict[Section, tuple[int, int]],
+                               allowed: int, weights: list[int],
+                               remaining: list[int] | None = None,
+                               course_masks: list[int] | None = None,
+                               chosen: list[int] | None = None,
+                               score: int = 0,
+                               should_stop: Callable[[], bool] | None = None,
+                               mandatory: list[bool] | None = None
+                               ) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Finds the same schedules as iter_schedules, but picks which course
+    to branch on next as it goes: mandatory courses first, then the course
+    with the fewest sections still compatible with the schedule. Branches
+    where a remaining mandatory course has no compatible section left are
+    dropped before they are explored (forward checking).
+    The schedules come out in a different order, so instead of making
+    them it yields the generation order key of each (see
+    schedules_from_keys) and its exact score, to put them back in order by
+    and make them from.
+    weights has what each course adds to a score, in units of 1 /
+    score_scale(courses) (see scaled_weights). remaining holds the indices
+    in courses of the courses left to add, course_masks the bitsets of each
+    course's sections, chosen the position of the section chosen in each
+    course so far and score the exact score of those sections.
+    mandatory has whether each course is mandatory.
+    should_stop is as in iter_schedules.
+    """
+    if PROFILE.enabled:
+        PROFILE.count('search nodes')
+    if should_stop is not None and should_stop():
+        return
+    if remaining is None:
+        remaining = [i for i, course in enumerate(courses) if course]
+    if course_masks is None:
+        course_masks = [sum(matrix[section][0] for section in course)
+                        for course in courses]
+    if chosen is None:
+        chosen = [len(course) for course in courses]
+    if mandatory is None:
+        mandatory = [bool(course) and course[0].is_mandatory()
+                     for course in courses]
+    if remaining == []:             # bottom of recursion
+        yield tuple(chosen), score
+        return
+
+    best = None
+    best_key = None
+    for i in remaining:
+        options = (allowed & course_masks[i]).bit_count()
+        if mandatory[i] and options == 0:
+            # no way to finish this schedule
+            if PROFILE.enabled:
+                PROFILE.count('forward check prunes')
+            return
+        key = (not mandatory[i], options)
+        if best_key is None or key < best_key:
+            best, best_key = i, key
+    rest = [i for i in remaining if i != best]
+
+    for position, section in enumerate(courses[best]):
+        bit, compatible = matrix[section]
+        if allowed & bit:
+            chosen[best] = position
+            yield from iter_schedules_constrained(
+                courses, matrix, allowed & compatible, weights, rest,
+                course_masks, chosen, score + weights[best], should_stop,
+                mandatory)
+        elif PROFILE.enabled:
+            PROFILE.count('conflicts')
+    # skipped, which is also how the caller expects to find it
+    chosen[best] = len(courses[best])
+    if not mandatory[best]:
+        yield from iter_schedules_constrained(courses, matrix, allowed,
+                                              weights, rest, course_masks,
+                                              chosen, score, should_stop,
+                                              mandatory)
+
+
+def make_schedules(existing_schedule: Schedule,
+                  courses_to_add: list[list[Section]],
+                  matrix: dict[Section, tuple[int, int]] | None = None,
+                  allowed: int = 0) -> list[Schedule]:
+    """Makes a list of schedules that contain each course no more than
+    one time. No schedule will be made that does not include the
+    mandatory courses. See iter_schedules.
+    """
+    return list(iter_schedules(existing_schedule, courses_to_add,
+                               matrix, allowed))
+
+
+def read_courses() -> list[list[Section]]:
+    """Returns the sections from courseData.txt grouped by course."""
+    with PROFILE.timer('parse'):
+        return list(load_catalog(COURSE_DATA_PATH).values())
+
+
+def stream_schedules(courses: list[list[Section]] | None = None,
+                     constrained: bool = False,
+                     should_stop: Callable[[], bool] | None = None
+                     ) -> Iterator[Schedule]:
+    """Yields every non-empty schedule that can be made from courses
+    (read from courseData.txt if not given) in generation order, without
+    ever holding the full list.
+    If constrained, the search is iter_schedules_constrained and the
+    schedules come out in its order, made with their sections in course
+    order.
+    should_stop is passed on to the search (see iter_schedules).
+    """
+    if courses is None:
+        courses = read_courses()
+    if constrained:
+        keys = (key for key, _ in stream_constrained(courses, should_stop))
+        yield from schedules_from_keys(keys, courses)
+        return
+    for schedule, _ in stream_scored(courses, should_stop):
+        yield schedule
+
+
+def stream_scored(courses: list[list[Section]],
+                  should_stop: Callable[[], bool] | None = None
+                  ) -> Iterator[tuple[Schedule, int]]:
+    """Yields every non-empty schedule that can be made from courses in
+    generation order, along with its exact score (see exact_score) in
+    units of 1 / score_scale(courses). should_stop is as in
+    iter_schedules.
+    """
+    # start off the recursive schedule generation
+    blank_schedule = Schedule()
+    matrix, allowed = make_conflict_matrix(courses)
+    _, course_weights = scaled_weights(courses)
+    weights = [course_weights[course[0].course] if course else 0
+               for course in courses]
+    for schedule, score in iter_scored_schedules(blank_schedule, courses,
+                                                 weights, 0, matrix, allowed,
+                                                 should_stop):
+        # skip empty schedules
+        if len(schedule) > 0:
+            if PROFILE.enabled:
+                PROFILE.count('schedules found')
+            yield schedule, score
+
+
+def stream_constrained(courses: list[list[Section]],
+                       should_stop: Callable[[], bool] | None = None
+                       ) -> Iterator[tuple[tuple[int, ...], int]]:
+    """Yields the generation order key and exact score of every non-empty
+    schedule that can be made from courses, in the order of
+    iter_schedules_constrained. should_stop is as in iter_schedules.
+    """
+    matrix, allowed = make_conflict_matrix(courses)
+    _, course_weights = scaled_weights(courses)
+    weights = [course_weights[course[0].course] if course else 0
+               for course in courses]
+    empty = tuple(len(course) for course in courses)
+    for key, score in iter_schedules_constrained(courses, matrix, allowed,
+                                                 weights,
+                                                 should_stop=should_stop):
+        if key != empty:
+            if PROFILE.enabled:
+                PROFILE.count('schedules found')
+            yield key, score
+
+
+def schedules_from_keys(keys: Iterable[tuple[int, ...]],
+                        courses: list[list[Section]]) -> Iterator[Schedule]:
+    """Makes the schedule with each generation order key, exactly as
+    generation would have made it: sections in course order, with the score
+    summed in that order.
+    A key has the position of the section chosen from each course, or the
+    number of sections if the course was skipped, since that comes after
+    choosing any of them. Schedules are generated in the order of their
+    keys.
+    """
+    weights = [course_weight(course[0].course) if course else 0
+               for course in courses]
+    for key in keys:
+        sections = []
+        score = 0
+        for course, weight, position in zip(courses, weights, key):
+            if position < len(course):
+                sections.append(course[position])
+                if weight:
+                    score += weight
+        yield Schedule(sections, score,
+                       min(section.start_time for section in sections),
+                       max(section.end_time for section in sections))
+
+
+def split_search(courses: list[list[Section]],
+                 matrix: dict[Section, tuple[int, int]], allowed: int,
+                 depth: int) -> list[list[int | None]]:
+    """Splits the search tree at its top depth levels, returning one
+    prefix per subtree, in generation order. A prefix lists, for each of
+    the first depth courses, the position of the chosen section in that
+    course or None if the course was skipped.
+    """
+    if depth == 0 or courses == []:
+        return [[]]
+    prefixes = []
+    for i, section in enumerate(courses[0]):
+        bit, compatible = matrix[section]
+        if allowed & bit:
+            prefixes += [[i] + prefix for prefix in
+                         split_search(courses[1:], matrix,
+                                      allowed & compatible, depth - 1)]
+    if not section.is_mandatory():
+        prefixes += [[None] + prefix for prefix in
+                     split_search(courses[1:], matrix, allowed, depth - 1)]
+    return prefixes
+
+
+def search_subtree(courses: list[list[Section]],
+                   matrix: dict[Section, tuple[int, int]], allowed: int,
+                   prefix: list[int | None]
+                   ) -> list[tuple[int, tuple[int, ...]]]:
+    """Enumerates the subtree under prefix (see split_search) and returns
+    its non-empty schedules sorted by score, each as its exact score (see
+    exact_score) and the indices of its sections among all of the
+    sections in courses.
+    Runs in a worker process, so it returns plain data.
+    """
+    flat = [section for course in courses for section in course]
+    index = {section: i for i, section in enumerate(flat)}
+    _, course_weights = scaled_weights(courses)
+    weights = [course_weights[course[0].course] if course else 0
+               for course in courses]
+    schedule = Schedule()
+    score = 0
+    for course, weight, position in zip(courses, weights, prefix):
+        if position is not None:
+            section = course[position]
+            schedule = schedule.add(section)
+            score += weight
+            allowed &= matrix[section][1]
+    results = [(sched_score,
+                tuple(index[section] for section in sched.sections))
+               for sched, sched_score in iter_scored_schedules(
+                   schedule, courses[len(prefix):], weights[len(prefix):],
+                   score, matrix, allowed)
+               if len(sched) > 0]
+    results.sort(key = lambda result: result[0], reverse = True)
+    return results
+
+
+def search_size(courses: list[list[Section]]) -> int:
+    """An upper bound on the number of schedules, ignoring conflicts."""
+    size = 1
+    for course in courses:
+        size *= len(course) + 1
+    return size
+
+
+def exact_weight(course: str) -> Fraction:
+    """What a course adds to a schedule's score, exactly."""
+    if PRIORITY_D[course] == 0:
+        return Fraction(0)
+    return Fraction(1, PRIORITY_D[course])
+
+
+def score_scale(courses: list[list[Section]]) -> int:
+    """The least common multiple of the priorities of courses, so that
+    every score is a whole number of 1 / scale.
+    """
+    return lcm(*[PRIORITY_D[course[0].course] for course in courses
+                 if course and PRIORITY_D[course[0].course] != 0])
+
+
+def scaled_weights(courses: list[list[Section]]
+                   ) -> tuple[int, dict[str, int]]:
+    """Returns the score scale of courses and what each course adds to a
+    score in units of 1 / scale. Scores summed from these are exact, unlike
+    the float scores, which can differ between schedules with equal scores
+    depending on the order they were added in. See exact_score.
+    """
+    scale = score_scale(courses)
+    return scale, {course[0].course: int(exact_weight(course[0].course)
+                                         * scale)
+                   for course in courses if course}
+
+
+def exact_score(schedule: Schedule, scale: int) -> int:
+    """The score of schedule in units of 1 / scale, exactly: the sum of
+    what each of its courses adds, scale // priority (see scaled_weights).
+    scale must be a multiple of the priorities of its courses, like the
+    score_scale of its catalog or priority_scale().
+    """
+    score = 0
+    for section in schedule.iter_sections():
+        priority = PRIORITY_D[section.course]
+        if priority != 0:
+            score += scale // priority
+    return score
 
 
-def get_sorted_schedules() -> list[Schedule]:
+def priority_scale() -> int:
+    """The score scale of every course with a priority, which works for
+    schedules whose catalog isn't at hand, since it is a multiple of
+    theirs (see score_scale).
+    """
+    return lcm(*[priority for priority in PRIORITY_D.values()
+                 if priority != 0])
+
+
+# how far below a float threshold a score can be and still count as
+# reaching it, relative to the threshold
+THRESHOLD_SLACK = Fraction(1, 10**9)
+
+
+def float_band(threshold: int, scale: int) -> tuple[float, float]:
+    """The float scores between which a schedule's float score can't tell
+    whether its exact score reaches an exact threshold. Below the band it
+    doesn't and above it it does, since float scores are off by far less
+    than THRESHOLD_SLACK of themselves.
+    """
+    value = threshold / scale      # int / int rounds correctly
+    return (value * (1 - float(THRESHOLD_SLACK)),
+            value * (1 + float(THRESHOLD_SLACK)))
+
+
+def exact_threshold(threshold: float, scale: int) -> int:
+    """The lowest exact score (see exact_score) that reaches a float
+    threshold. A threshold within float error of a score, like one copied
+    from a schedule, counts as that score. The threshold is scaled as a
+    Fraction, since a float product loses the units of large scales.
+    """
+    threshold = Fraction(threshold)
+    return ceil((threshold - abs(threshold) * THRESHOLD_SLACK) * scale)
+
+
+def idle_minutes(schedule: Schedule) -> int:
+    """The minutes between meetings on the same day, summed over the
+    week."""
+    meetings: dict[str, list[tuple[int, int]]] = {}
+    for section in schedule.sections:
+        start = section.start_time.hour * 60 + section.start_time.minute
+        end = section.end_time.hour * 60 + section.end_time.minute
+        for day in section.days:
+            meetings.setdefault(day, []).append((start, end))
+    idle = 0
+    for day_meetings in meetings.values():
+        day_meetings.sort()
+        for (_, end), (start, _) in zip(day_meetings, day_meetings[1:]):
+            idle += max(0, start - end)
+    return idle
+
+
+# ways to order schedules with the same score, by name. Schedules tied
+# on these too stay in generation order.
+TIE_BREAKS = {
+    'generation': None,
+    'earliest_end': lambda schedule: schedule.end_time,
+    'latest_start': lambda schedule: (-schedule.start_time.hour,
+                                      -schedule.start_time.minute),
+    'compactness': idle_minutes,
+}
+
+
+def iter_score_buckets(scored: Iterable[tuple], courses: list[list[Section]],
+                       tie_break: str = 'generation', keyed: bool = False
+                       ) -> Iterator[tuple[Fraction, list[Schedule]]]:
+    """Groups schedules by exact score and yields each score with its
+    schedules, from the highest score down. Within a score the schedules
+    keep their order, or are ordered by the tie_break in TIE_BREAKS.
+    scored has (schedule, exact score) pairs, in units of 1 /
+    score_scale(courses), as stream_scored yields them.
+    Scores come from a small set, so this is a counting sort rather than
+    a comparison sort of every schedule.
+    If keyed, the pairs are (generation order key, exact score) pairs of
+    schedules found out of generation order, and the schedules of each
+    score are made from their keys in generation order (see
+    schedules_from_keys).
+    """
+    key = TIE_BREAKS[tie_break]
+    scale = score_scale(courses)
+    buckets: dict[int, list] = {}
+    for item, score in scored:
+        if score in buckets:
+            buckets[score].append(item)
+        else:
+            buckets[score] = [item]
+    for score in sorted(buckets, reverse=True):
+        bucket = buckets.pop(score)
+        if keyed:
+            bucket.sort()
+            bucket = list(schedules_from_keys(bucket, courses))
+        if key is not None:
+            bucket.sort(key=key)
+        yield Fraction(score, scale), bucket
+
+
+def bucket_sort(scored: Iterable[tuple], courses: list[list[Section]],
+                tie_break: str = 'generation',
+                keyed: bool = False) -> list[Schedule]:
+    """Sorts schedules given with their exact scores, highest first,
+    keeping their order or ordering them by tie_break within each score
+    (see iter_score_buckets).
+    With nothing to make or order within the scores, a stable sort on the
+    scores does the same in C, which is quicker than bucketing in Python.
+    """
+    if not keyed and TIE_BREAKS[tie_break] is None:
+        pairs = list(scored)
+        # stable, and reverse keeps it so
+        pairs.sort(key=itemgetter(1), reverse=True)
+        return [schedule for schedule, _ in pairs]
+    return [schedule
+            for _, bucket in iter_score_buckets(scored, courses, tie_break,
+                                                keyed)
+            for schedule in bucket]
+
+
+def sort_schedules(schedules: Iterable[Schedule],
+                   courses: list[list[Section]],
+                   tie_break: str = 'generation') -> list[Schedule]:
+    """Sorts schedules made in any order, with their sections in any
+    order, by score and then by the order generation would have made them
+    in, which is the order get_sorted_schedules gives. A tie_break from
+    TIE_BREAKS comes before the generation order.
+    The schedules are remade as generation would have made them (see
+    schedules_from_keys).
+    """
+    position = {}
+    for course in courses:
+        for i, section in enumerate(course):
+            position[section] = i
+    course_index = {course[0].course: i for i, course in enumerate(courses)
+                    if course}
+    _, weights = scaled_weights(courses)
+
+    def key_and_score(schedule: Schedule) -> tuple[tuple[int, ...], int]:
+        # skipping a course comes after choosing any of its sections
+        key = [len(course) for course in courses]
+        score = 0
+        for section in schedule.sections:
+            key[course_index[section.course]] = position[section]
+            score += weights[section.course]
+        return tuple(key), score
+
+    return bucket_sort(map(key_and_score, schedules), courses, tie_break,
+                       keyed=True)
+
+
+def get_sorted_schedules(workers: int = 1, split_depth: int = 1,
+                         constrained: bool = False,
+                         tie_break: str = 'generation'
+                         ) -> Sequence[Schedule]:
     """Facilitates the generation of schedules by getting sections from
     courseData.txt and then wrapping the recursive makeSchedules with
     starter parameters
+
+    The schedules are returned as a sequence: a list, or, if some course
+    has sections that meet at the same times, an ExpandedSchedules. Then
+    the search (serial, parallel or constrained, as below) is over their
+    equivalence classes instead, and the schedules are made as they are
+    read (see equivalence.py), in the same order.
+
+    With more than one worker, the search tree is split at its top
+    split_depth levels and the subtrees are searched in a process pool.
+    Their sorted results are merged as they come back, in exactly the order
+    the serial search gives. Small searches are always done serially.
+
+    If constrained, the serial search uses the most-constrained-course-first
+    order of iter_schedules_constrained, which explores fewer dead ends.
+    The result is the same. It is only quicker when most branches die out,
+    as when most courses are mandatory and few schedules are possible
+    (about twice as fast with 10 of 14 synthetic courses mandatory). When
+    most branches end in schedules, as on the bundled catalog, making the
+    schedules from their keys costs more than it saves.
+
+    Schedules are ordered by their exact score (see exact_score) and
+    then by generation order, or by tie_break (see TIE_BREAKS) first.
     """
-    # get sections from text file
-    with open(COURSE_DATA_PATH, 'r') as f:
-        sections = list(read_sections(f).values())
-    # start off the recursive schedule generation
-    blank_schedule = Schedule()
-    schedules = make_schedules(blank_schedule, sections)
-    # remove empty schedules and sort them by score
-    schedules = list(filter(lambda x: len(x.sections) > 0, schedules))
-    schedules.sort(key = lambda sched: sched.score, reverse = True)
+    from equivalence import get_expanded_schedules, has_classes
+    courses = read_courses()
+    if has_classes(courses):
+        # timed as generate and sort inside
+        schedules = get_expanded_schedules(courses, tie_break, workers,
+                                           split_depth, constrained)
+    elif constrained:
+        # bucket by score, putting each score's schedules back in
+        # generation order by their keys
+        with PROFILE.timer('generate'):
+            keyed = list(stream_constrained(courses))
+        with PROFILE.timer('sort'):
+            schedules = bucket_sort(keyed, courses, tie_break, keyed=True)
+    elif workers <= 1 or search_size(courses) < PARALLEL_MIN_SEARCH:
+        with PROFILE.timer('generate'):
+            scored = list(stream_scored(courses))
+        with PROFILE.timer('sort'):
+            schedules = bucket_sort(scored, courses, tie_break)
+    else:
+        # the subtrees are merged in order as they come back, which is
+        # timed with them, so only the tie break is timed as sort
+        with PROFILE.timer('generate'):
+            scored = search_parallel(courses, workers, split_depth)
+        with PROFILE.timer('sort'):
+            if tie_break != 'generation':
+                schedules = bucket_sort(scored, courses, tie_break)
+            else:
+                schedules = [schedule for schedule, _ in scored]
+    if PROFILE.enabled:
+        PROFILE.count('schedules', len(schedules))
+    return schedules
+
+
+def search_parallel(courses: list[list[Section]], workers: int,
+                    split_depth: int) -> list[tuple[Schedule, int]]:
+    """The parallel path of get_sorted_schedules. Returns the schedules
+    in order, each with its exact score (see exact_score).
+    """
+    matrix, allowed = make_conflict_matrix(courses)
+    prefixes = split_search(courses, matrix, allowed, split_depth)
+    flat = [section for course in courses for section in course]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(search_subtree, courses, matrix, allowed,
+                                   prefix)
+                   for prefix in prefixes]
+
+        def results(future):
+            yield from future.result()
+
+        # merge keeps subtrees in generation order when scores tie, just
+        # like the buckets of the serial path
+        schedules = []
+        for score, indices in heapq.merge(*map(results, futures),
+                                          key = lambda result: -result[0]):
+            schedule = Schedule()
+            for i in indices:
+                schedule = schedule.add(flat[i])
+            schedules.append((schedule, score))
     return schedules
 
 
-def writeJSON():
-    import json
-    schedules = get_sorted_schedules()
-    with open(JSON_WRITE_PATH, 'w') as f:
-        json.dump([schedule.to_dictionary() for schedule in schedules], f)
+def course_weight(course: str) -> float:
+    """The most a course can add to a schedule's score (see
+    Schedule.updateScore).
+    """
+    if PRIORITY_D[course] == 0:
+        return 0
+    return float(1 / PRIORITY_D[course])
+
+
+def get_top_schedules(k: int,
+                      courses: list[list[Section]] | None = None,
+                      tie_break: str = 'generation') -> list[Schedule]:
+    """Returns the k best schedules, in the same order as the first k of
+    get_sorted_schedules with tie_break, without enumerating every
+    schedule.
+    This is a branch-and-bound search: the best score a partial schedule
+    could still reach is its score plus the weights of the remaining
+    courses that have a compatible section left, and branches whose bound
+    cannot reach the lowest score among the k best schedules found so far
+    are pruned. Scores are compared exactly (see exact_score). In
+    generation order a later schedule needs a strictly higher score to
+    make the k best, but with another tie_break every schedule tied at the
+    lowest score is kept until the end, since any of them could come
+    first.
+    """
+    if courses is None:
+        courses = read_courses()
+    if k <= 0 or not courses:
+        return []
+    tie_key = TIE_BREAKS[tie_break]
+    matrix, allowed = make_conflict_matrix(courses)
+    course_masks = [sum(matrix[section][0] for section in course)
+                    for course in courses]
+    _, course_weights = scaled_weights(courses)
+    weights = [course_weights[course[0].course] if course else 0
+               for course in courses]
+    # the schedules kept so far by exact score, each in generation order,
+    # and a min-heap of their scores
+    buckets: dict[int, list[Schedule]] = {}
+    scores: list[int] = []
+    kept = 0
+
+    def loses(score: int) -> bool:
+        """Whether a schedule with score found now can't make the k best."""
+        return kept >= k and (score < scores[0]
+                              or score == scores[0] and tie_key is None)
+
+    def keep(schedule: Schedule, score: int):
+        nonlocal kept
+        if loses(score):
+            return
+        if score not in buckets:
+            buckets[score] = []
+            heapq.heappush(scores, score)
+        buckets[score].append(schedule)
+        kept += 1
+        # drop the lowest score once the higher ones make up k schedules
+        while kept - len(buckets[scores[0]]) >= k:
+            kept -= len(buckets.pop(heapq.heappop(scores)))
+        if tie_key is None and kept > k:
+            # only the first of the lowest score can still make it
+            lowest = buckets[scores[0]]
+            del lowest[len(lowest) - (kept - k):]
+            kept = k
+
+    def search(schedule: Schedule, score: int, i: int, allowed: int):
+        if PROFILE.enabled:
+            PROFILE.count('search nodes')
+        if kept >= k and loses(score + sum(
+                weights[j] for j in range(i, len(courses))
+                if allowed & course_masks[j])):
+            if PROFILE.enabled:
+                PROFILE.count('bound prunes')
+            return
+        if i == len(courses):       # bottom of recursion
+            if len(schedule) > 0:
+                keep(schedule, score)
+            return
+        for section in courses[i]:
+            bit, compatible = matrix[section]
+            if allowed & bit:
+                search(schedule.add(section), score + weights[i], i + 1,
+                       allowed & compatible)
+            elif PROFILE.enabled:
+                PROFILE.count('conflicts')
+        if not section.is_mandatory():
+            search(schedule, score, i + 1, allowed)
+
+    search(Schedule(), 0, 0, allowed)
+    top: list[Schedule] = []
+    for score in sorted(buckets, reverse=True):
+        bucket = buckets[score]
+        if tie_key is not None:
+            bucket.sort(key=tie_key)    # stable, so generation order on ties
+        top += bucket
+    return top[:k]
+
+
+def writeJSON(sort: bool = True, workers: int = 1,
+              constrained: bool = False, tie_break: str = 'generation'):
+    """Writes the schedules to sorted_schedules.json one at a time. If not
+    sorted, they are written as they are generated, so the full list is
+    never held in memory.
+    """
+    from compression import write_json_array
+    if sort:
+        schedules = get_sorted_schedules(workers, constrained=constrained,
+                                         tie_break=tie_break)
+    else:
+        schedules = stream_schedules(constrained=constrained)
+    with PROFILE.timer('serialize'), open(JSON_WRITE_PATH, 'w') as f:
+        write_json_array((schedule.to_dictionary() for schedule in schedules),
+                         f)
+
+
+def readJSON(f: TextIOWrapper) -> Iterator[Schedule]:
+    """Yields the schedules in an opened schedules JSON file one at a
+    time, without loading the whole file.
+    """
+    from compression import iter_json_array
+    for d in iter_json_array(f):
+        yield Schedule.from_dictionary(d)
+
+
+def writeBinary(workers: int = 1, constrained: bool = False,
+                tie_break: str = 'generation'):
+    """Writes the sorted schedules to the binary store, along with the
+    manifest cache.update_schedules updates them from (see
+    cache.save_schedules), so the two never disagree.
+    """
+    import cache
+    courses = load_catalog(COURSE_DATA_PATH)
+    schedules = get_sorted_schedules(workers, constrained=constrained,
+                                     tie_break=tie_break)
+    with PROFILE.timer('serialize'):
+        cache.save_schedules(courses, schedules, tie_break)
 
 if __name__ == "__main__":
-    # import sys
-    # if len(sys.argv) > 0 and sys.argv[1] == 'write':
-    #     writeJSON()
-    pass
+    import argparse
+    import profiling
+    parser = argparse.ArgumentParser(
+        description="Generate the sorted schedules and write them to data.")
+    parser.add_argument('format', choices=['json', 'binary'],
+                        help="write sorted_schedules.json or .bin")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes to search with")
+    parser.add_argument('--constrained', action='store_true',
+                        help="search the most constrained course first, "
+                             "which is quicker only when most courses are "
+                             "mandatory and few schedules are possible")
+    parser.add_argument('--tie-break', choices=list(TIE_BREAKS),
+                        default='generation',
+                        help="how to order schedules with the same score")
+    parser.add_argument('--profile', nargs='?', const='-', metavar='PATH',
+                        help="report counters, timers and peak memory, as "
+                             "JSON to PATH if given")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="trace the peak memory with tracemalloc")
+    args = parser.parse_args()
+
+    if args.profile:
+        profiling.enable(args.trace_memory)
+    if args.format == 'json':
+        writeJSON(workers=args.workers, constrained=args.constrained,
+                  tie_break=args.tie_break)
+    else:
+        writeBinary(workers=args.workers, constrained=args.constrained,
+                    tie_break=args.tie_break)
+    if args.profile == '-':
+        print(PROFILE)
+    elif args.profile:
+        with open(args.profile, 'w') as f:
+            PROFILE.toJSON(f)
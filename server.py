@@ -0,0 +1,372 @@
+"""A local HTTP/JSON service for browsing schedules, so several clients can
+page and filter the same results at once.
+
+The sorted schedules are generated once (in a worker process, so queries
+stay responsive) and then shared by every client through the memory-mapped
+store, along with one index for filtering. Filter sets are lists of
+filters in the format of Filterer.toJSON, and can be saved by name.
+
+Endpoints (all responses are JSON):
+GET    /status                  whether schedules are ready, and how many
+POST   /generate                (re)generate the schedules if the course
+                                data or priorities changed, or always with
+                                ?force=1
+GET    /schedules               a page of schedules, with ?start=, ?count=
+                                and either ?filters=<saved name> or
+                                ?filter=<filter set JSON>
+GET    /schedules/<number>      the details of one schedule, numbered as in
+                                the pages with the same filters
+GET    /closed                  the sections closed, which no schedule
+                                listed has
+PUT    /closed/<course>/<section>    close a section that filled up
+DELETE /closed/<course>/<section>    reopen a section
+GET    /filters                 the names of the saved filter sets
+GET    /filters/<name>          a saved filter set
+PUT    /filters/<name>          save the filter set in the request body
+DELETE /filters/<name>          delete a saved filter set
+
+Run python server.py [--host HOST] [--port PORT].
+"""
+
+from browser import PAGE_SIZE, count_optimal, is_stale
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from filter import (Filterer, ScheduleIndex, VIEW_CACHE_SIZE,
+                    load_closed_sections, save_closed_sections)
+from urllib.parse import parse_qs, unquote, urlsplit
+import argparse
+import asyncio
+import cache
+import json
+import os
+import store
+
+FILTER_SETS_PATH = os.path.join('data', 'filter_sets.json')
+MAX_PAGE_SIZE = 100
+MAX_BODY = 1 << 20
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+           405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def update_store():
+    """Brings the stored schedules up to date. Runs in a worker process."""
+    cache.update_schedules()
+
+
+class ScheduleService:
+    """The shared state behind the endpoints: the schedules, their index,
+    the saved filter sets and a Filterer (with its cached views) for each
+    filter set recently asked for.
+    """
+    def __init__(self, executor: ProcessPoolExecutor):
+        self.executor = executor
+        self.schedules: store.ScheduleReader | None = None
+        self.index: ScheduleIndex | None = None
+        self.optimal: int | None = None     # see count_optimal
+        self.generating: asyncio.Task | None = None
+        # filtering shares the Filterers' view caches, so one at a time
+        self.lock = asyncio.Lock()
+        self.filterers: OrderedDict[str, Filterer] = OrderedDict()
+        self.filter_sets: dict[str, list] = {}
+        self.closed = set(load_closed_sections())
+        if os.path.exists(FILTER_SETS_PATH):
+            with open(FILTER_SETS_PATH) as f:
+                self.filter_sets = json.load(f)
+
+    async def generate(self, force: bool = False):
+        """Loads the schedules, generating them first if they are stale.
+        Clients asking while that happens wait for the same generation.
+        """
+        if self.generating is None:
+            if self.schedules is not None and not force and not is_stale():
+                return
+            self.generating = asyncio.create_task(self.load(force))
+        task = self.generating
+        try:
+            await asyncio.shield(task)
+        finally:
+            if self.generating is task and task.done():
+                self.generating = None
+
+    async def load(self, force: bool):
+        loop = asyncio.get_running_loop()
+        if force or is_stale():
+            await loop.run_in_executor(self.executor, update_store)
+        with open(store.BINARY_WRITE_PATH, 'rb') as f:
+            schedules = store.ScheduleReader(f)
+        # the old schedules may still be paged through by other requests.
+        # The store is replaced rather than rewritten (see
+        # cache.save_schedules), so they keep mapping the old file and are
+        # left to be closed when no longer referenced
+        async with self.lock:
+            self.schedules = schedules
+            self.index = None
+            self.optimal = None
+            self.filterers.clear()
+
+    async def ready(self) -> store.ScheduleReader:
+        if self.schedules is None or self.generating is not None:
+            await self.generate()
+        return self.schedules
+
+    def filter_set(self, query: dict) -> list:
+        """The filter set named or given in the query."""
+        if 'filters' in query:
+            name = query['filters'][0]
+            if name not in self.filter_sets:
+                raise HTTPError(404, "No filter set named " + repr(name))
+            return self.filter_sets[name]
+        if 'filter' in query:
+            try:
+                return json.loads(query['filter'][0])
+            except json.JSONDecodeError:
+                raise HTTPError(400, "The filter set is not valid JSON")
+        return []
+
+    def filterer(self, info: list) -> Filterer:
+        """The Filterer for a filter set, kept so its views are reused."""
+        key = json.dumps(info, sort_keys=True)
+        if key in self.filterers:
+            self.filterers.move_to_end(key)
+            return self.filterers[key]
+        try:
+            filterer = Filterer.fromJSON(key)
+        except (ValueError, TypeError, KeyError, IndexError) as e:
+            raise HTTPError(400, "Invalid filter set: " + str(e))
+        self.filterers[key] = filterer
+        if len(self.filterers) > VIEW_CACHE_SIZE:
+            self.filterers.popitem(last=False)
+        return filterer
+
+    async def filtered(self, query: dict):
+        """The schedules passing the filter set in the query."""
+        schedules = await self.ready()
+        info = self.filter_set(query)
+        if not info and not self.closed:
+            return schedules
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            # read again under the lock, in case load swapped them since
+            schedules = self.schedules
+            filterer = self.filterer(info)
+            index = await self.indexed()
+            return await loop.run_in_executor(
+                None, filterer.view, schedules, index)
+
+    async def indexed(self) -> ScheduleIndex:
+        """The index of the current schedules, built with the closed
+        sections closed if it hasn't been. Call while holding the lock, so
+        load can't swap the schedules while it is built.
+        """
+        if self.index is None:
+            loop = asyncio.get_running_loop()
+            index = await loop.run_in_executor(None, ScheduleIndex,
+                                               self.schedules)
+            for course, section in self.closed:
+                index.close(course, section)
+            self.index = index
+        return self.index
+
+    async def count_optimal(self) -> int:
+        """The number of optimal schedules without closed sections. It is
+        counted in a thread, so a large tie doesn't hold up other requests,
+        and kept until the schedules or the closed sections change.
+        """
+        if self.optimal is not None:
+            return self.optimal
+        schedules = self.schedules
+        closed = frozenset(self.closed)
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(None, count_optimal, schedules,
+                                           closed)
+        if schedules is self.schedules and closed == self.closed:
+            self.optimal = count
+        return count
+
+    async def close(self, course: str, section: str, closed: bool) -> dict:
+        """Closes or reopens a section for every client. Schedules with it
+        are dropped through the index, without searching again.
+        """
+        await self.ready()
+        async with self.lock:
+            index = await self.indexed()
+            if closed:
+                self.closed.add((course, section))
+                index.close(course, section)
+            else:
+                self.closed.discard((course, section))
+                index.reopen(course, section)
+            self.optimal = None
+            save_closed_sections(self.closed)
+            return {'closed': sorted(self.closed),
+                    'schedules': index.all.bit_count()}
+
+    async def status(self, query: dict) -> dict:
+        if self.schedules is None:
+            return {'ready': False, 'generating': self.generating is not None}
+        return {'ready': True, 'generating': self.generating is not None,
+                'schedules': len(self.schedules),
+                'optimal': await self.count_optimal(),
+                'closed': sorted(self.closed)}
+
+    async def page(self, query: dict) -> dict:
+        start = int_parameter(query, 'start', 0)
+        count = min(int_parameter(query, 'count', PAGE_SIZE), MAX_PAGE_SIZE)
+        schedules = await self.filtered(query)
+        return {'total': len(schedules), 'start': start,
+                'schedules': [dict(schedule.to_dictionary(), number=i)
+                              for i, schedule in enumerate(
+                                  schedules[start:start + count], start)]}
+
+    async def details(self, query: dict, number: int) -> dict:
+        schedules = await self.filtered(query)
+        if not 0 <= number < len(schedules):
+            raise HTTPError(404, "No schedule #{}".format(number))
+        schedule = schedules[number]
+        # like browser.get_schedule, what is needed to find the sections
+        return dict(schedule.to_dictionary(), number=number,
+                    portal=[[section.course, section.section]
+                            for section in schedule.sections],
+                    summary=schedule.summarize_daily())
+
+    def save_filter_set(self, name: str, info: list):
+        self.filterer(info)     # checks that the filter set is valid
+        self.filter_sets[name] = info
+        self.write_filter_sets()
+
+    def delete_filter_set(self, name: str):
+        if name not in self.filter_sets:
+            raise HTTPError(404, "No filter set named " + repr(name))
+        del self.filter_sets[name]
+        self.write_filter_sets()
+
+    def write_filter_sets(self):
+        with open(FILTER_SETS_PATH, 'w') as f:
+            json.dump(self.filter_sets, f, indent=2)
+
+    async def route(self, method: str, path: str, query: dict,
+                    body: bytes) -> dict | list:
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if parts == ['status'] and method == 'GET':
+            return await self.status(query)
+        if parts == ['generate'] and method == 'POST':
+            await self.generate(force=query.get('force') == ['1'])
+            return await self.status(query)
+        if parts[0] == 'schedules' and method == 'GET':
+            if len(parts) == 1:
+                return await self.page(query)
+            if len(parts) == 2 and parts[1].isdigit():
+                return await self.details(query, int(parts[1]))
+        if parts[0] == 'closed':
+            if len(parts) == 1 and method == 'GET':
+                return sorted(self.closed)
+            if len(parts) == 3 and method in ('PUT', 'DELETE'):
+                return await self.close(parts[1], parts[2], method == 'PUT')
+        if parts[0] == 'filters':
+            if len(parts) == 1 and method == 'GET':
+                return sorted(self.filter_sets)
+            if len(parts) == 2:
+                name = parts[1]
+                if method == 'GET':
+                    if name not in self.filter_sets:
+                        raise HTTPError(404, "No filter set named "
+                                        + repr(name))
+                    return self.filter_sets[name]
+                if method == 'PUT':
+                    try:
+                        info = json.loads(body)
+                    except json.JSONDecodeError:
+                        raise HTTPError(400, "The filter set is not valid "
+                                        "JSON")
+                    self.save_filter_set(name, info)
+                    return {'saved': name}
+                if method == 'DELETE':
+                    self.delete_filter_set(name)
+                    return {'deleted': name}
+                raise HTTPError(405, method + " is not allowed here")
+        raise HTTPError(404, "No endpoint " + method + " " + path)
+
+
+def int_parameter(query: dict, name: str, default: int) -> int:
+    if name not in query:
+        return default
+    try:
+        value = int(query[name][0])
+    except ValueError:
+        raise HTTPError(400, name + " must be an integer")
+    if value < 0:
+        raise HTTPError(400, name + " must not be negative")
+    return value
+
+
+async def handle(service: ScheduleService, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+    """Answers one HTTP request on a connection, then closes it."""
+    try:
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            method, target, _ = request_line.split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                raise HTTPError(413, "The request body is too large")
+            body = await reader.readexactly(length) if length else b''
+            url = urlsplit(target)
+            status = 200
+            result = await service.route(method, url.path,
+                                         parse_qs(url.query), body)
+        except HTTPError as e:
+            status, result = e.status, {'error': str(e)}
+        except ValueError as e:
+            status, result = 400, {'error': str(e)}
+        except Exception as e:
+            status, result = 500, {'error': repr(e)}
+        content = json.dumps(result).encode()
+        writer.write('HTTP/1.1 {} {}\r\n'
+                     'Content-Type: application/json\r\n'
+                     'Content-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(
+                         status, REASONS[status], len(content)).encode()
+                     + content)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, workers: int):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        service = ScheduleService(executor)
+        server = await asyncio.start_server(
+            lambda reader, writer: handle(service, reader, writer),
+            host, port)
+        print('Serving schedules on http://{}:{}'.format(host, port))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the sorted schedules over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes to generate schedules in")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
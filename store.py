@@ -0,0 +1,172 @@
+"""Compact binary storage for sorted schedules.
+
+The section table is written once, and each schedule is stored as its
+score followed by a fixed-width array of indices into that table, so any
+schedule can be read without touching the rest of the file.
+
+Layout (little-endian):
+    header      magic, section count, record width, schedule count and
+                section table length
+    sections    the section table, a UTF-8 JSON array of Section
+                dictionaries (see Section.to_dictionary)
+    records     one per schedule: the score as a double followed by width
+                unsigned shorts indexing the section table, padded with EMPTY
+"""
+
+from compression import iter_json_array, write_json_array
+from datatypes import Schedule, Section
+from io import BufferedReader, BufferedWriter, TextIOWrapper
+from typing import Iterable, Iterator
+import json
+import mmap
+import os
+import struct
+
+BINARY_WRITE_PATH = os.path.join('data', 'sorted_schedules.bin')
+
+MAGIC = b'CSCHED01'
+HEADER = struct.Struct('<8sIIQI')
+EMPTY = 0xFFFF      # index padding for schedules with fewer sections
+
+
+def record_struct(width: int) -> struct.Struct:
+    """The struct of one schedule record with room for width sections."""
+    return struct.Struct('<d' + 'H' * width)
+
+
+def section_key(section: Section) -> tuple[str, str]:
+    """Identifies a section in the section table."""
+    return (section.course, section.section)
+
+
+class ScheduleWriter:
+    """Writes schedules one at a time to an opened binary file.
+    The sections of every schedule written must be in the section table.
+    Use as a context manager, or call close when done.
+    """
+    def __init__(self, f: BufferedWriter, sections: list[Section]):
+        if len(sections) >= EMPTY:
+            raise ValueError("Too many sections for the binary format: "
+                             + str(len(sections)))
+        self.f = f
+        self.index = {section_key(section): i
+                      for i, section in enumerate(sections)}
+        # a schedule never has more than one section of each course
+        self.width = len(set(section.course for section in sections))
+        self.record = record_struct(self.width)
+        self.count = 0
+        table = json.dumps([section.to_dictionary()
+                            for section in sections]).encode()
+        self.table_length = len(table)
+        self.start = f.tell()
+        f.write(HEADER.pack(MAGIC, len(sections), self.width, 0,
+                            self.table_length))
+        f.write(table)
+
+    def write(self, schedule: Schedule):
+        indices = [self.index[section_key(section)]
+                   for section in schedule.sections]
+        indices += [EMPTY] * (self.width - len(indices))
+        self.f.write(self.record.pack(schedule.score, *indices))
+        self.count += 1
+
+    def close(self):
+        """Fills in the schedule count in the header."""
+        end = self.f.tell()
+        self.f.seek(self.start)
+        self.f.write(HEADER.pack(MAGIC, len(self.index), self.width,
+                                 self.count, self.table_length))
+        self.f.seek(end)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ScheduleReader:
+    """Reads schedules from a binary schedule file by memory-mapping it.
+    Indexing and slicing only decode the records asked for.
+    """
+    def __init__(self, f: BufferedReader):
+        self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, section_count, self.width, self.count, table_length = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a binary schedule file")
+        table = self.mm[HEADER.size:HEADER.size + table_length]
+        self.sections = [Section.from_dictionary(d)
+                         for d in json.loads(table)]
+        self.record = record_struct(self.width)
+        self.offset = HEADER.size + table_length
+
+    def __len__(self):
+        return self.count
+
+    def read(self, i: int) -> tuple[float, list[Section]]:
+        """Returns the score and sections of schedule i."""
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("schedule index out of range")
+        score, *indices = self.record.unpack_from(
+            self.mm, self.offset + i * self.record.size)
+        return score, [self.sections[j] for j in indices if j != EMPTY]
+
+    def __getitem__(self, i: int | slice) -> Schedule | list[Schedule]:
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(self.count))]
+        score, sections = self.read(i)
+        start_time = min(section.start_time for section in sections)
+        end_time = max(section.end_time for section in sections)
+        return Schedule(sections, score, start_time, end_time)
+
+    def __iter__(self) -> Iterator[Schedule]:
+        for i in range(self.count):
+            yield self[i]
+
+    def close(self):
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_schedules(f: BufferedWriter, schedules: Iterable[Schedule],
+                    sections: list[Section]):
+    """Writes schedules to an opened binary file with the section table
+    sections.
+    """
+    with ScheduleWriter(f, sections) as writer:
+        for schedule in schedules:
+            writer.write(schedule)
+
+
+def json_to_binary(read_file: TextIOWrapper, write_file: BufferedWriter):
+    """Converts a sorted schedules JSON file into the binary format.
+    The JSON is streamed twice, first for the section table and then for
+    the schedules, so it is never loaded whole.
+    """
+    # collect the section table in order of first appearance
+    start = read_file.tell()
+    sections = {}
+    for d in iter_json_array(read_file):
+        for section in d['sections']:
+            key = (section['course'], section['section'])
+            if key not in sections:
+                sections[key] = Section.from_dictionary(section)
+    read_file.seek(start)
+    schedules = (Schedule.from_dictionary(d)
+                 for d in iter_json_array(read_file))
+    write_schedules(write_file, schedules, list(sections.values()))
+
+
+def binary_to_json(read_file: BufferedReader, write_file: TextIOWrapper):
+    """Converts a binary schedule file into the sorted schedules JSON."""
+    with ScheduleReader(read_file) as reader:
+        write_json_array((schedule.to_dictionary() for schedule in reader),
+                         write_file)